@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import faiss
+import numpy as np
+
+# Recommender index backend: flat (exact), ivf_flat, ivf_pq or hnsw
+INDEX_TYPE = os.getenv("RECOMMENDER_INDEX", "flat").lower()
+INDEX_DIR = os.getenv(
+    "RECOMMENDER_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'embedding_cache', 'ann')
+)
+# IVF: number of coarse cells (capped at ~sqrt(n) for small catalogs) and cells probed per query
+IVF_NLIST = int(os.getenv("RECOMMENDER_IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.getenv("RECOMMENDER_IVF_NPROBE", "16"))
+# PQ: sub-quantizers (must divide the embedding dim) and bits per code
+PQ_M = int(os.getenv("RECOMMENDER_PQ_M", "48"))
+PQ_NBITS = int(os.getenv("RECOMMENDER_PQ_NBITS", "8"))
+# HNSW: graph degree and search-time beam width
+HNSW_M = int(os.getenv("RECOMMENDER_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("RECOMMENDER_HNSW_EF_SEARCH", "64"))
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def _nlist_for(n: int) -> int:
+    return max(1, min(IVF_NLIST, int(np.sqrt(n))))
+
+
+def _resolve_type(index_type: str, n: int, dim: int) -> str:
+    """Fall back to a simpler backend when the catalog is too small or dim doesn't fit."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if index_type == "ivf_pq":
+        if dim % PQ_M != 0:
+            print(f"PQ_M={PQ_M} does not divide dim={dim}, using ivf_flat")
+            return "ivf_flat"
+        if n < 2 ** PQ_NBITS:
+            print(f"Only {n} vectors, too few to train PQ codebooks, using ivf_flat")
+            return "ivf_flat"
+    return index_type
+
+
+def build_index(embeddings: np.ndarray, index_type: str = INDEX_TYPE):
+    """Build (and train, where needed) a FAISS L2 index over the embeddings."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n, dim = embeddings.shape
+    index_type = _resolve_type(index_type, n, dim)
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        nlist = _nlist_for(n)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS)
+        index.train(embeddings)
+    index.add(embeddings)
+    configure_search(index)
+    return index
+
+
+def configure_search(index):
+    """Apply search-time parameters; these are not persisted by faiss.write_index."""
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return
+    try:
+        faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    except RuntimeError:
+        pass  # not an IVF index
+
+
+def search_params(index, selector):
+    """SearchParameters restricting a search to `selector`, keeping the configured nprobe/efSearch."""
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=HNSW_EF_SEARCH)
+    try:
+        faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return faiss.SearchParameters(sel=selector)
+    return faiss.SearchParametersIVF(sel=selector, nprobe=IVF_NPROBE)
+
+
+def measure_recall(index, embeddings: np.ndarray, k: int = 10, n_queries: int = 1000, seed: int = 0) -> float:
+    """
+    Recall@k of the index against an exact flat search. Queries are sampled
+    catalog vectors with small noise so they don't trivially match themselves.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    n = embeddings.shape[0]
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    sample = embeddings[rng.choice(n, size=min(n_queries, n), replace=False)]
+    queries = sample + rng.normal(scale=0.01, size=sample.shape).astype(np.float32)
+
+    flat = faiss.IndexFlatL2(embeddings.shape[1])
+    flat.add(embeddings)
+    _, truth = flat.search(queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    return hits / float(truth.size)
+
+
+def _params(index_type: str) -> dict:
+    if index_type in ("ivf_flat", "ivf_pq"):
+        params = {"nlist": IVF_NLIST}
+        if index_type == "ivf_pq":
+            params.update(m=PQ_M, nbits=PQ_NBITS)
+        return params
+    if index_type == "hnsw":
+        return {"m": HNSW_M}
+    return {}
+
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class CourseANNIndex:
+    """
+    FAISS index over the course embeddings whose ids are stable slots rather
+    than catalog rows, persisted with the (course id, text hash) key each slot
+    holds. A catalog change adds vectors for new or edited courses and retires
+    the slots of removed or edited ones, so an IVF/HNSW index is trained once
+    and never rebuilt when a single course changes. IVF indexes drop retired
+    slots; flat and HNSW can't, so theirs stay in the index and are masked
+    out of every search.
+    """
+
+    def __init__(self, index, index_type, slot_keys, trained_on, directory=None):
+        self.index = index
+        self.index_type = index_type
+        self.slot_keys = slot_keys  # slot -> course key, None once retired
+        self.trained_on = trained_on
+        self.directory = directory
+        self.removable = index_type in ("ivf_flat", "ivf_pq")
+        self.report = {}
+
+    @classmethod
+    def build(cls, embeddings, keys, index_type, directory=None):
+        """Build (and train) a fresh index over all rows; slot i holds row i."""
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type)
+        ann = cls(index, index_type, list(keys), len(keys), directory)
+        ann.sync(embeddings, keys)
+        if index_type != "flat":
+            ann.report = {"build_seconds": time.perf_counter() - start, "recall_at_10": measure_recall(index, embeddings)}
+            print(f"Built {index_type} index in {ann.report['build_seconds']:.2f}s, "
+                  f"recall@10 vs flat: {ann.report['recall_at_10']:.3f}")
+        return ann
+
+    @classmethod
+    def load(cls, directory):
+        """The index last saved to `directory`, or None if there is none (or it is unreadable)."""
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            index = faiss.read_index(os.path.join(directory, manifest['index_file']))
+            with open(os.path.join(directory, manifest['slots_file']), 'r', encoding='utf-8') as f:
+                slot_keys = json.load(f)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            print(f"ANN index in {directory} unreadable, rebuilding: {e}")
+            return None
+        ann = cls(index, manifest['index_type'], slot_keys, manifest['trained_on'], directory)
+        expected = sum(key is not None for key in slot_keys) if ann.removable else len(slot_keys)
+        if index.ntotal != manifest['count'] or index.ntotal != expected:
+            print(f"ANN index in {directory} does not match its manifest, rebuilding")
+            return None
+        configure_search(index)
+        print(f"Loaded trained {ann.index_type} index from {directory}")
+        return ann
+
+    def sync(self, embeddings, keys):
+        """
+        Point the index at the current catalog (`embeddings` and `keys` by row):
+        new keys get a vector in a new slot, vanished keys have their slot
+        retired. Returns (added, retired).
+        """
+        slot_of = {key: slot for slot, key in enumerate(self.slot_keys) if key is not None}
+        row_slots = np.empty(len(keys), dtype=np.int64)
+        new_rows = []
+        for row, key in enumerate(keys):
+            slot = slot_of.pop(key, None)
+            if slot is None:
+                new_rows.append(row)
+            else:
+                row_slots[row] = slot
+        retired = sorted(slot_of.values())
+        if retired and self.removable:
+            self.index.remove_ids(np.array(retired, dtype=np.int64))
+        for slot in retired:
+            self.slot_keys[slot] = None
+        if new_rows:
+            slots = np.arange(len(self.slot_keys), len(self.slot_keys) + len(new_rows), dtype=np.int64)
+            vectors = np.ascontiguousarray(embeddings[new_rows], dtype=np.float32)
+            if self.removable:
+                self.index.add_with_ids(vectors, slots)
+            else:
+                # Flat and HNSW number vectors in insertion order, which is slot order
+                self.index.add(vectors)
+            self.slot_keys.extend(keys[row] for row in new_rows)
+            row_slots[new_rows] = slots
+        self.row_slots = row_slots
+        self.slot_rows = np.full(len(self.slot_keys), -1, dtype=np.int64)
+        self.slot_rows[row_slots] = np.arange(len(keys))
+        dead = not self.removable and len(keys) < len(self.slot_keys)
+        self._live_bits = np.packbits(self.slot_rows >= 0, bitorder='little') if dead else None
+        return len(new_rows), len(retired)
+
+    def drifted(self) -> bool:
+        """True once retired slots outnumber live ones or the catalog has grown well past what was trained on."""
+        live = len(self.row_slots)
+        return len(self.slot_keys) - live > live or live > 4 * max(self.trained_on, 1)
+
+    def search(self, vectors: np.ndarray, k: int, mask: np.ndarray = None):
+        """
+        k nearest courses per query as (L2 distances, catalog rows), -1 padded
+        like faiss; `mask` restricts the search to those rows via an ID selector.
+        """
+        if mask is None and self._live_bits is None:
+            D, I = self.index.search(vectors, k)
+        else:
+            if mask is None:
+                bits, nbits = self._live_bits, len(self.slot_rows)
+            else:
+                allowed = np.zeros(len(self.slot_rows), dtype=bool)
+                allowed[self.row_slots[mask]] = True
+                bits, nbits = np.packbits(allowed, bitorder='little'), len(allowed)
+            selector = faiss.IDSelectorBitmap(nbits, faiss.swig_ptr(bits))
+            D, I = self.index.search(vectors, k, params=search_params(self.index, selector))
+        return D, np.where(I >= 0, self.slot_rows[I], -1)
+
+    def save(self, directory=None):
+        """
+        Write versioned index/slot files, then atomically swap the manifest to
+        point at them, so readers never see a half-written index.
+        """
+        directory = directory or self.directory
+        os.makedirs(directory, exist_ok=True)
+        version = f"{int(time.time() * 1000)}-{os.getpid()}"
+        index_file, slots_file = f"index-{version}.faiss", f"slots-{version}.json"
+        faiss.write_index(self.index, os.path.join(directory, index_file))
+        with open(os.path.join(directory, slots_file), 'w', encoding='utf-8') as f:
+            json.dump(self.slot_keys, f)
+        manifest = {
+            "index_type": self.index_type,
+            "params": _params(self.index_type),
+            "dim": self.index.d,
+            "count": int(self.index.ntotal),
+            "trained_on": self.trained_on,
+            "index_file": index_file,
+            "slots_file": slots_file,
+            "index_bytes": os.path.getsize(os.path.join(directory, index_file)),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            **self.report,
+        }
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        keep = {index_file, slots_file}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+            keep.update((previous.get('index_file'), previous.get('slots_file')))
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+        # Drop older versions, keeping the previous one for readers that just read the old manifest
+        for name in os.listdir(directory):
+            if name.startswith(('index-', 'slots-')) and name not in keep:
+                os.remove(os.path.join(directory, name))
+
+
+def index_directory(model_name: str, index_type: str) -> str:
+    key = hashlib.sha256(json.dumps([model_name, index_type, _params(index_type)]).encode()).hexdigest()[:16]
+    return os.path.join(INDEX_DIR, f"{index_type}-{key}")
+
+
+def load_or_build_index(embeddings: np.ndarray, keys, model_name: str, index_type: str = INDEX_TYPE,
+                        rebuild: bool = False) -> CourseANNIndex:
+    """
+    Load the persisted index for this model and backend and bring it up to
+    date with the catalog incrementally (see CourseANNIndex.sync), or build,
+    evaluate and persist a new one when there is none or `rebuild` is set.
+    Incremental changes are left to the caller to save. The flat backend is
+    cheap to rebuild and is never written to disk.
+    """
+    # Key and name the files by the backend actually built, not the one asked for
+    index_type = _resolve_type(index_type, *np.shape(embeddings))
+    if index_type == "flat":
+        return CourseANNIndex.build(embeddings, keys, index_type)
+
+    directory = index_directory(model_name, index_type)
+    ann = None if rebuild else CourseANNIndex.load(directory)
+    if ann is None:
+        ann = CourseANNIndex.build(embeddings, keys, index_type, directory)
+        ann.save()
+        return ann
+    added, retired = ann.sync(embeddings, keys)
+    if added or retired:
+        print(f"Updated {index_type} index: {added} courses added, {retired} retired")
+    if ann.drifted():
+        print(f"The {index_type} index has drifted from the catalog it was trained on; "
+              f"retrain it with `python -m app.load_courses_in_faiss rebuild`")
+    return ann
+
+
+def main():
+    """Compare every backend on the cached course embeddings: recall, latency and size."""
+    from app.course_index import get_course_index
+
+    parser = argparse.ArgumentParser(description="Evaluate ANN index backends against the flat baseline")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    args = parser.parse_args()
+
+    embeddings = np.ascontiguousarray(get_course_index().embeddings, dtype=np.float32)
+    for index_type in INDEX_TYPES:
+        start = time.perf_counter()
+        index = build_index(embeddings, index_type)
+        build_seconds = time.perf_counter() - start
+        recall = measure_recall(index, embeddings, k=args.k, n_queries=args.queries)
+        queries = embeddings[:min(args.queries, len(embeddings))]
+        start = time.perf_counter()
+        index.search(queries, args.k)
+        per_query_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        size = len(faiss.serialize_index(index))
+        print(f"{index_type:9s} recall@{args.k}={recall:.3f} build={build_seconds:.2f}s "
+              f"search={per_query_ms:.3f}ms/query size={size / 1e6:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import sys
+import numpy as np
+from app.database import iter_course_rows
+from app.models import Course
+
+# Columns every stored course row has as a string
+TEXT_FIELDS = ('id', 'title', 'description', 'skill_level', 'duration', 'url')
+
+
+class StringColumn:
+    """Immutable column of strings packed into one UTF-8 buffer plus offsets."""
+
+    def __init__(self, values):
+        encoded = [v.encode('utf-8') for v in values]
+        self.data = b''.join(encoded)
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+
+class CategoryColumn:
+    """Low-cardinality strings stored as integer codes into a vocabulary of interned values."""
+
+    def __init__(self, values):
+        index = {}
+        codes = [index.setdefault(v, len(index)) for v in values]
+        self.vocab = [sys.intern(v) if isinstance(v, str) else v for v in index]
+        self.codes = np.array(codes, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.vocab[self.codes[i]]
+
+
+class CourseCatalog:
+    """
+    Columnar, read-only course catalog. Free text lives in packed UTF-8
+    buffers, repeated values (skill level, provider, duration) and tags are
+    integer codes into interned vocabularies, and a Course object is only
+    built when a row is actually returned. Indexing and iteration yield
+    Course objects, so it can stand in for a list of courses.
+    """
+
+    def __init__(self, courses):
+        ids, titles, descriptions, urls = [], [], [], []
+        skill_levels, providers, durations = [], [], []
+        tag_index, tag_ids, tag_counts = {}, [], []
+        for course in courses:
+            # Rows were validated when they were ingested (or by the one-time migration in
+            # init_courses_db); only a cheap shape check is left, so model_construct is safe below
+            if not isinstance(course['tags'], list) or not all(isinstance(course[f], str) for f in TEXT_FIELDS):
+                print(f"Skipping malformed course row {course.get('id')!r}")
+                continue
+            ids.append(sys.intern(course['id']))
+            titles.append(course['title'])
+            descriptions.append(course['description'])
+            urls.append(course['url'])
+            skill_levels.append(course['skill_level'])
+            providers.append(course.get('provider'))
+            durations.append(course['duration'])
+            tag_ids.extend(tag_index.setdefault(tag, len(tag_index)) for tag in course['tags'])
+            tag_counts.append(len(course['tags']))
+        self.ids = ids
+        self.titles = StringColumn(titles)
+        self.descriptions = StringColumn(descriptions)
+        self.urls = StringColumn(urls)
+        self.skill_levels = CategoryColumn(skill_levels)
+        self.providers = CategoryColumn(providers)
+        self.durations = CategoryColumn(durations)
+        # Tags as CSR: row i has tag_ids[tag_indptr[i]:tag_indptr[i + 1]]
+        self.tag_vocab = [sys.intern(tag) for tag in tag_index]
+        self.tag_ids = np.array(tag_ids, dtype=np.int32)
+        self.tag_indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(tag_counts, out=self.tag_indptr[1:])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def tags(self, row):
+        return [self.tag_vocab[t] for t in self.tag_ids[self.tag_indptr[row]:self.tag_indptr[row + 1]]]
+
+    def text(self, row) -> str:
+        """Same text as embedding_store.course_text, without building a Course."""
+        return f"{self.titles[row]} {self.descriptions[row]} {' '.join(self.tags(row))}"
+
+    def __getitem__(self, row) -> Course:
+        # Values were validated on ingest, so the model is built without re-validation
+        return Course.model_construct(
+            id=self.ids[row],
+            title=self.titles[row],
+            description=self.descriptions[row],
+            skill_level=self.skill_levels[row],
+            tags=self.tags(row),
+            duration=self.durations[row],
+            url=self.urls[row],
+            provider=self.providers[row],
+        )
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+
+def load_catalog() -> CourseCatalog:
+    """Build the catalog from the courses table, streaming rows instead of creating a Course per row."""
+    return CourseCatalog(iter_course_rows())
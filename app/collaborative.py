@@ -0,0 +1,223 @@
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from app.database import iter_feedback_chunks, init_feedback_db
+from app.embedding_store import CACHE_DIR
+
+MODEL_PATH = os.getenv("CF_MODEL_PATH", os.path.join(CACHE_DIR, "collaborative.npz"))
+# Implicit ALS: latent factors, sweeps, L2 regularisation and confidence given to each rating
+CF_FACTORS = int(os.getenv("CF_FACTORS", "32"))
+CF_ITERATIONS = int(os.getenv("CF_ITERATIONS", "10"))
+CF_REGULARIZATION = float(os.getenv("CF_REGULARIZATION", "0.1"))
+CF_ALPHA = float(os.getenv("CF_ALPHA", "10"))
+CF_WORKERS = int(os.getenv("CF_WORKERS", str(os.cpu_count() or 1)))
+CF_CHUNK_SIZE = int(os.getenv("CF_CHUNK_SIZE", "100000"))
+# Nonzeros per task; bounds the (nnz, f, f) temporaries, and longer rows are split into slices of this size
+CF_BLOCK_NNZ = int(os.getenv("CF_BLOCK_NNZ", "4096"))
+# How often servers check for a newly trained model
+CF_RELOAD_CHECK_SECONDS = float(os.getenv("CF_RELOAD_CHECK_SECONDS", "60"))
+
+
+def load_feedback_matrix(chunk_size=CF_CHUNK_SIZE):
+    """
+    Stream the feedback table into COO arrays. A like is preference 1, a
+    dislike preference 0; both are observed with confidence 1 + CF_ALPHA.
+    Returns (user_ids, course_ids, user_idx, course_idx, preference).
+    """
+    user_rows, course_rows = {}, {}
+    users, courses, prefs = [], [], []
+    for rows in iter_feedback_chunks(chunk_size):
+        chunk = [row for row in rows if row['feedback'] in ('like', 'dislike')]
+        users.append(np.fromiter(
+            (user_rows.setdefault(row['user_id'], len(user_rows)) for row in chunk), dtype=np.int32, count=len(chunk)))
+        courses.append(np.fromiter(
+            (course_rows.setdefault(row['course_id'], len(course_rows)) for row in chunk), dtype=np.int32, count=len(chunk)))
+        prefs.append(np.fromiter((row['feedback'] == 'like' for row in chunk), dtype=np.float32, count=len(chunk)))
+    concat = lambda parts, dtype: np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+    return (list(user_rows), list(course_rows),
+            concat(users, np.int32), concat(courses, np.int32), concat(prefs, np.float32))
+
+
+def _csr(rows, cols, values, n_rows):
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order], values[order]
+
+
+def _blocks(indptr):
+    """
+    Work items (start, end, lo, hi): rows start..end, whose nonzeros are
+    lo..hi. Runs of rows are grouped up to CF_BLOCK_NNZ nonzeros (empty rows
+    count as one); a row with more than CF_BLOCK_NNZ nonzeros is split into
+    slices of that size, so no item's temporaries grow with a row's length.
+    """
+    offsets = indptr.tolist()
+    blocks = []
+    start, cost = 0, 0
+    for row in range(len(offsets) - 1):
+        count = offsets[row + 1] - offsets[row]
+        if count > CF_BLOCK_NNZ:
+            if row > start:
+                blocks.append((start, row, offsets[start], offsets[row]))
+            blocks.extend((row, row + 1, lo, min(lo + CF_BLOCK_NNZ, offsets[row + 1]))
+                          for lo in range(offsets[row], offsets[row + 1], CF_BLOCK_NNZ))
+            start, cost = row + 1, 0
+            continue
+        if cost + max(count, 1) > CF_BLOCK_NNZ and row > start:
+            blocks.append((start, row, offsets[start], offsets[row]))
+            start, cost = row, 0
+        cost += max(count, 1)
+    if start < len(offsets) - 1:
+        blocks.append((start, len(offsets) - 1, offsets[start], offsets[-1]))
+    return blocks
+
+
+def _sums(start, end, lo, hi, indptr, cols, prefs, Y):
+    """Per-row Gram matrices sum(y y^T) and sum(p y) over nonzeros lo..hi of rows start..end."""
+    f = Y.shape[1]
+    Yi = Y[cols[lo:hi]]
+    if end - start == 1:
+        return (Yi.T @ Yi)[None], (prefs[lo:hi] @ Yi)[None]
+    G = np.zeros((end - start, f, f))
+    r = np.zeros((end - start, f))
+    counts = np.diff(indptr[start:end + 1])
+    if hi > lo:
+        # Bounded by CF_BLOCK_NNZ: _blocks never groups more nonzeros than that
+        starts = (indptr[start:end] - lo)[counts > 0]
+        G[counts > 0] = np.add.reduceat(np.einsum('ni,nj->nij', Yi, Yi), starts, axis=0)
+        r[counts > 0] = np.add.reduceat(prefs[lo:hi, None] * Yi, starts, axis=0)
+    return G, r
+
+
+def _solve(base, G, r):
+    # (C_u - I) only has the observed entries, each CF_ALPHA above the baseline of 1
+    return np.linalg.solve(base + CF_ALPHA * G, ((1 + CF_ALPHA) * r)[:, :, None])[:, :, 0]
+
+
+def _solve_block(start, end, lo, hi, indptr, cols, prefs, Y, base):
+    """
+    Closed-form ALS update for rows start..end against fixed factors Y. A
+    slice of a split row returns its partial sums instead, for the caller to
+    add up and solve.
+    """
+    G, r = _sums(start, end, lo, hi, indptr, cols, prefs, Y)
+    if hi - lo < indptr[end] - indptr[start]:
+        return start, None, (G, r)
+    return start, _solve(base, G, r), None
+
+
+def _als_step(indptr, cols, prefs, Y, blocks, pool):
+    f = Y.shape[1]
+    base = Y.T @ Y + CF_REGULARIZATION * np.eye(f)
+    X = np.zeros((len(indptr) - 1, f))
+    split = {}
+    for start, solved, partial in pool.map(lambda block: _solve_block(*block, indptr, cols, prefs, Y, base), blocks):
+        if solved is not None:
+            X[start:start + len(solved)] = solved
+        elif start in split:
+            split[start] = (split[start][0] + partial[0], split[start][1] + partial[1])
+        else:
+            split[start] = partial
+    for row, (G, r) in split.items():
+        X[row] = _solve(base, G, r)[0]
+    return X
+
+
+def train(factors=CF_FACTORS, iterations=CF_ITERATIONS, workers=CF_WORKERS, chunk_size=CF_CHUNK_SIZE, seed=0):
+    """
+    Train implicit-feedback ALS (Hu, Koren & Volinsky) on the feedback table
+    and write user and course factors to MODEL_PATH. Row blocks are solved
+    in a thread pool; NumPy's batched solves release the GIL.
+    """
+    start_time = time.perf_counter()
+    user_ids, course_ids, users, courses, prefs = load_feedback_matrix(chunk_size)
+    if len(prefs) == 0:
+        print("No feedback to train on")
+        return None
+    print(f"Loaded {len(prefs)} ratings from {len(user_ids)} users on {len(course_ids)} courses")
+    user_csr = _csr(users, courses, prefs, len(user_ids))
+    course_csr = _csr(courses, users, prefs, len(course_ids))
+
+    user_blocks, course_blocks = _blocks(user_csr[0]), _blocks(course_csr[0])
+
+    rng = np.random.default_rng(seed)
+    Y = rng.normal(scale=0.01, size=(len(course_ids), factors))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(iterations):
+            X = _als_step(*user_csr, Y, user_blocks, pool)
+            Y = _als_step(*course_csr, X, course_blocks, pool)
+
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    tmp_path = f"{MODEL_PATH}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, user_ids=np.array(user_ids, dtype=str), user_factors=X.astype(np.float32),
+             course_ids=np.array(course_ids, dtype=str), course_factors=Y.astype(np.float32))
+    os.replace(tmp_path, MODEL_PATH)
+    print(f"Trained {factors}-factor ALS model in {time.perf_counter() - start_time:.1f}s -> {MODEL_PATH}")
+    return MODEL_PATH
+
+
+class FactorModel:
+    """Trained user and course factors; a user's predicted affinity for a course is their dot product."""
+
+    def __init__(self, user_ids, user_factors, course_ids, course_factors):
+        self.user_rows = {u: i for i, u in enumerate(user_ids)}
+        self.user_factors = user_factors
+        self.course_rows = {c: i for i, c in enumerate(course_ids)}
+        self.course_factors = course_factors
+        self.version = None
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['user_ids'].tolist(), data['user_factors'],
+                       data['course_ids'].tolist(), data['course_factors'])
+
+
+_model = None
+_model_mtime = None
+_checked_at = 0.0
+_model_lock = threading.Lock()
+
+
+def get_factor_model():
+    """The latest trained FactorModel, or None if no model has been trained yet."""
+    global _model, _model_mtime, _checked_at
+    now = time.monotonic()
+    if _checked_at and now - _checked_at < CF_RELOAD_CHECK_SECONDS:
+        return _model
+    with _model_lock:
+        if not _checked_at or now - _checked_at >= CF_RELOAD_CHECK_SECONDS:
+            try:
+                mtime = os.stat(MODEL_PATH).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != _model_mtime:
+                try:
+                    _model = FactorModel.load() if mtime is not None else None
+                    _model_mtime = mtime
+                    if _model is not None:
+                        _model.version = mtime
+                        print(f"Loaded collaborative model: {len(_model.user_rows)} users, {len(_model.course_rows)} courses")
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Collaborative model unreadable, keeping the previous one: {e}")
+            _checked_at = time.monotonic()
+    return _model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the collaborative-filtering model from the feedback table")
+    parser.add_argument("--factors", type=int, default=CF_FACTORS)
+    parser.add_argument("--iterations", type=int, default=CF_ITERATIONS)
+    parser.add_argument("--workers", type=int, default=CF_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=CF_CHUNK_SIZE)
+    args = parser.parse_args()
+    init_feedback_db()
+    train(args.factors, args.iterations, args.workers, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
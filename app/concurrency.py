@@ -0,0 +1,53 @@
+import os
+import time
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from app.metrics import llm_call_seconds, llm_errors_total, llm_tokens_total
+
+# Bounded pool for blocking work (SQLite, FAISS search, sync-only clients) called from async code
+SYNC_WORKERS = int(os.getenv("QA_SYNC_WORKERS", "8"))
+# Max /query pipelines in flight per worker; extra requests wait instead of piling onto the LLMs
+QUERY_CONCURRENCY = int(os.getenv("QA_QUERY_CONCURRENCY", "64"))
+# Max concurrent outbound LLM / web search calls per worker
+LLM_CONCURRENCY = int(os.getenv("QA_LLM_CONCURRENCY", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="qa-sync")
+query_slots = asyncio.Semaphore(QUERY_CONCURRENCY)
+llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+
+
+async def run_sync(fn, *args, **kwargs):
+    """Run a blocking callable on the bounded pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Carry the request's context (trace id) into the worker thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+def _target(runnable) -> str:
+    return getattr(runnable, 'model', None) or getattr(runnable, 'name', None) or type(runnable).__name__
+
+
+async def call_llm(runnable, payload):
+    """ainvoke an LLM or tool while holding one of the outbound call slots; records latency and token usage."""
+    target = _target(runnable)
+    async with llm_slots:
+        start = time.perf_counter()
+        try:
+            result = await runnable.ainvoke(payload)
+        except Exception:
+            llm_errors_total.inc(1, target)
+            raise
+        finally:
+            llm_call_seconds.observe(time.perf_counter() - start, target)
+    usage = getattr(result, 'usage_metadata', None)
+    if usage:
+        llm_tokens_total.inc(usage.get('input_tokens', 0), target, "input")
+        llm_tokens_total.inc(usage.get('output_tokens', 0), target, "output")
+    return result
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
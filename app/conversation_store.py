@@ -0,0 +1,158 @@
+import os
+import gzip
+import json
+import time
+import argparse
+import threading
+from app.database import (
+    CONVO_DB_PATH, init_convo_db, save_conversation, get_recent_conversations, archive_conversation_chunk,
+)
+from app.lru_cache import LRUCache
+
+# Turns of history given to the classifier and synthesizer prompts
+HISTORY_TURNS = int(os.getenv("CONVERSATION_HISTORY_TURNS", "3"))
+# Active threads whose recent turns are kept in memory. Entries expire so that turns written
+# by another worker process to the same thread are picked up within the TTL.
+CONVERSATION_CACHE_THREADS = int(os.getenv("CONVERSATION_CACHE_THREADS", "10000"))
+CONVERSATION_CACHE_TTL_SECONDS = float(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "600"))
+# Threads idle longer than this are moved to compressed cold storage by `archive`
+RETENTION_DAYS = float(os.getenv("CONVERSATION_RETENTION_DAYS", "30"))
+ARCHIVE_DIR = os.getenv("CONVERSATION_ARCHIVE_DIR", os.path.join(os.path.dirname(CONVO_DB_PATH), 'conversation_archive'))
+ARCHIVE_CHUNK = 500
+
+# thread_id -> tuple of the newest HISTORY_TURNS turns, newest first
+history_cache = LRUCache(CONVERSATION_CACHE_THREADS, CONVERSATION_CACHE_TTL_SECONDS)
+# Serialize the SQLite read/write and cache update of a thread, so a miss-fill racing
+# a new turn can neither put stale history back nor count the turn twice
+_thread_locks = [threading.Lock() for _ in range(64)]
+
+
+def _lock_for(thread_id):
+    return _thread_locks[hash(thread_id) % len(_thread_locks)]
+
+
+def recent_turns(thread_id):
+    """Newest HISTORY_TURNS turns of a thread as [{query, response}], from memory when the thread is active."""
+    turns = history_cache.get(thread_id)
+    if turns is None:
+        with _lock_for(thread_id):
+            turns = history_cache.get(thread_id)
+            if turns is None:
+                turns = tuple(get_recent_conversations(thread_id, HISTORY_TURNS))
+                history_cache.put(thread_id, turns)
+    return [dict(turn) for turn in turns]
+
+
+def record_turn(thread_id, user_id, query, response):
+    """Persist a turn and write it through to the cached history of its thread."""
+    with _lock_for(thread_id):
+        save_conversation(thread_id, user_id, query, response)
+        turns = history_cache.get(thread_id)
+        # Uncached threads are read from SQLite (which now has this turn) on their next lookup
+        if turns is not None:
+            history_cache.put(thread_id, ({"query": query, "response": response},) + turns[:HISTORY_TURNS - 1])
+
+
+def cache_stats():
+    return history_cache.stats()
+
+
+class ColdArchive:
+    """
+    Append-only gzip'd NDJSON file, one line per archived thread:
+    {"thread_id", "user_id", "turns": [{"query", "response", "timestamp"}]}.
+    Each sync() appends the pending lines as one complete gzip member, so
+    everything synced stays readable if the process dies mid-archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+        self._pending = []
+        self.threads = 0
+        self.turns = 0
+
+    def add(self, thread_id, rows):
+        line = {
+            "thread_id": thread_id,
+            "user_id": rows[0]['user_id'] if rows else None,
+            "turns": [{"query": row['query'], "response": row['response'], "timestamp": row['timestamp']} for row in rows],
+        }
+        self._pending.append(json.dumps(line) + "\n")
+        self.threads += 1
+        self.turns += len(rows)
+
+    def sync(self):
+        if self._pending:
+            self._file.write(gzip.compress("".join(self._pending).encode('utf-8')))
+            self._pending = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def archive(retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR, chunk_size=ARCHIVE_CHUNK):
+    """
+    Move threads with no turn in the last retention_days out of the
+    conversations table into archive_dir/conversations-<time>.jsonl.gz, one
+    chunk of threads per write transaction. Returns the archive path, or
+    None when nothing was old enough.
+    """
+    cutoff = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - retention_days * 86400))
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"conversations-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}.jsonl.gz")
+    cold = ColdArchive(path)
+    after = ''
+    try:
+        while True:
+            thread_ids = archive_conversation_chunk(cutoff, after, chunk_size, cold)
+            if not thread_ids:
+                break
+            after = thread_ids[-1]
+            archived = set(thread_ids)
+            history_cache.discard_where(lambda key: key in archived)
+    finally:
+        cold.close()
+    if not cold.threads:
+        os.remove(path)
+        print(f"No threads idle since {cutoff} UTC")
+        return None
+    print(f"Archived {cold.threads} threads ({cold.turns} turns) idle since {cutoff} UTC to {path}")
+    return path
+
+
+def iter_archived(archive_dir=ARCHIVE_DIR, thread_id=None):
+    """Yield archived threads (optionally only `thread_id`) from every cold-storage file, oldest file first."""
+    for name in sorted(os.listdir(archive_dir)) if os.path.isdir(archive_dir) else []:
+        if not name.endswith('.jsonl.gz'):
+            continue
+        with gzip.open(os.path.join(archive_dir, name), 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    thread = json.loads(line)
+                    if thread_id is None or thread['thread_id'] == thread_id:
+                        yield thread
+            except (EOFError, gzip.BadGzipFile):
+                # A chunk cut off mid-write; its rows were never deleted from SQLite
+                print(f"Skipping truncated chunk at the end of {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation history retention")
+    parser.add_argument("command", choices=["archive", "show"])
+    parser.add_argument("--days", type=float, default=RETENTION_DAYS, help="archive threads idle for this long")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--thread-id", help="thread to print with `show`")
+    args = parser.parse_args()
+    if args.command == "archive":
+        init_convo_db()
+        archive(args.days, args.archive_dir)
+    else:
+        for thread in iter_archived(args.archive_dir, args.thread_id):
+            print(json.dumps(thread))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+from app.database import get_catalog_version
+from app.embedding_store import MODEL_NAME, encode_with_cache, catalog_fingerprint, text_hash
+from app.catalog import load_catalog
+from app.ann_index import load_or_build_index
+from app.lexical_index import load_or_build_lexical_index
+from app.collaborative import get_factor_model
+from app.lru_cache import LRUCache
+from app.embedding_service import get_embedding_service
+from app.onnx_encoder import OnnxEncoder, ONNX_QUANTIZED
+from app.metrics import retrieval_stage_seconds
+
+# torch (SentenceTransformer) or onnx (exported graph on onnxruntime, see app.onnx_encoder)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+# Identifies the embedding space in the on-disk store; ONNX/int8 vectors are kept apart from torch ones
+EMBEDDING_KEY = MODEL_NAME if EMBED_BACKEND == "torch" else f"{MODEL_NAME}-onnx{'-int8' if ONNX_QUANTIZED else ''}"
+# How often a worker checks SQLite for catalog changes made by other processes
+RELOAD_CHECK_SECONDS = float(os.getenv("COURSE_INDEX_RELOAD_CHECK_SECONDS", "5"))
+# Filtered searches with at most this many qualifying courses are scored exactly with NumPy
+BRUTE_FORCE_MAX = int(os.getenv("COURSE_INDEX_BRUTE_FORCE_MAX", "20000"))
+# Study effort assumed when a duration is given in calendar time rather than hours
+HOURS_PER_WEEK = float(os.getenv("COURSE_HOURS_PER_WEEK", "5"))
+
+# hybrid (dense + BM25, fused), dense or lexical; lexical never touches the embedder
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# Candidates taken from each ranking before fusion, and the reciprocal rank fusion constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Weight of the collaborative-filtering ranking relative to the dense and lexical ones
+CF_WEIGHT = float(os.getenv("CF_WEIGHT", "0.5"))
+# Concurrent query encodes allowed before hybrid search degrades to lexical-only
+MAX_CONCURRENT_ENCODES = int(os.getenv("HYBRID_MAX_CONCURRENT_ENCODES", "8"))
+# Recently encoded query texts kept in memory
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(hour|hr|day|week|month)s?", re.IGNORECASE)
+_UNIT_HOURS = {"hour": 1.0, "hr": 1.0, "day": HOURS_PER_WEEK / 5, "week": HOURS_PER_WEEK, "month": HOURS_PER_WEEK * 4.33}
+
+_model = None
+_model_lock = threading.Lock()
+_course_index = None
+_checked_at = 0.0
+_reloading = False
+_index_lock = threading.Lock()
+_encode_slots = threading.BoundedSemaphore(MAX_CONCURRENT_ENCODES)
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+
+
+def get_model():
+    """Process-wide encoder shared by the recommender and the QA bot (backend set by EMBED_BACKEND)."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                print("Starting embedding the models")
+                if EMBED_BACKEND == "onnx":
+                    _model = OnnxEncoder()
+                else:
+                    from sentence_transformers import SentenceTransformer
+                    _model = SentenceTransformer(MODEL_NAME)
+    return _model
+
+
+def parse_duration_hours(duration: str) -> float:
+    """'45 hours' -> 45, '6 weeks' -> 6 * HOURS_PER_WEEK; NaN when unparseable."""
+    match = _DURATION_RE.search(duration or "")
+    if not match:
+        return float('nan')
+    return float(match.group(1)) * _UNIT_HOURS[match.group(2).lower()]
+
+
+def index_keys(courses, texts):
+    """Per-row key of the ANN index: a course's vector is replaced whenever its id or embedded text changes."""
+    return [f"{course_id}:{text_hash(EMBEDDING_KEY, text)[:16]}" for course_id, text in zip(courses.ids, texts)]
+
+
+def filter_key(filters) -> tuple:
+    """Hashable form of a query's attribute filters (exclude_ids aside), for sharing one mask between queries."""
+    return tuple(sorted(
+        (name, tuple(sorted(value)) if isinstance(value, (list, set, tuple)) else value)
+        for name, value in (filters or {}).items() if name != 'exclude_ids' and value
+    ))
+
+
+class CourseIndex:
+    """
+    The one retrieval engine over the course catalog: a single embedding
+    matrix (title + description + tags, from the on-disk embedding store) and
+    a single FAISS index whose ids are rows of `courses` (a CourseCatalog).
+    """
+
+    def __init__(self, courses, model, catalog_version=0):
+        self.courses = courses
+        self.model = model
+        self.catalog_version = catalog_version
+        self.rows = {course_id: i for i, course_id in enumerate(courses.ids)}
+        texts = [courses.text(row) for row in range(len(courses))]
+        # Only new or edited courses are encoded; the rest come from the on-disk store
+        self.embeddings = encode_with_cache(model, EMBEDDING_KEY, texts)
+        self.fingerprint = catalog_fingerprint(EMBEDDING_KEY, texts)
+        # Backend chosen by RECOMMENDER_INDEX (flat/ivf_flat/ivf_pq/hnsw); a trained index is loaded
+        # from disk and only the changed courses are added to or retired from it
+        self.index = load_or_build_index(self.embeddings, index_keys(courses, texts), EMBEDDING_KEY)
+        self.lexical = load_or_build_lexical_index(texts)
+        self._cf = (None, None)
+        self._build_columns()
+
+    def __len__(self):
+        return len(self.courses)
+
+    def encode(self, queries) -> np.ndarray:
+        if isinstance(queries, str):
+            queries = [queries]
+        if isinstance(queries, np.ndarray):
+            return np.ascontiguousarray(queries.reshape(-1, queries.shape[-1]), dtype=np.float32)
+        queries = list(queries)
+        cached = [query_embedding_cache.get(q) for q in queries]
+        missing = list(dict.fromkeys(q for q, vector in zip(queries, cached) if vector is None))
+        if missing:
+            # Batched with concurrent requests' queries by the embedding service
+            encoded = dict(zip(missing, get_embedding_service().encode(missing)))
+            for q, vector in encoded.items():
+                query_embedding_cache.put(q, vector)
+            cached = [encoded[q] if vector is None else vector for q, vector in zip(queries, cached)]
+        return np.stack(cached) if cached else np.zeros((0, self.embeddings.shape[1]), dtype=np.float32)
+
+    def try_encode(self, queries):
+        """
+        Encode queries unless dense retrieval is disabled or MAX_CONCURRENT_ENCODES
+        encodes are already running (and the query isn't cached); None tells
+        callers to go lexical-only.
+        """
+        if RETRIEVAL_MODE == "lexical":
+            return None
+        if not _encode_slots.acquire(blocking=False):
+            # Saturated: a cached single query can still be served
+            cached = query_embedding_cache.get(queries) if isinstance(queries, str) else None
+            return None if cached is None else cached[None]
+        try:
+            return self.encode(queries)
+        finally:
+            _encode_slots.release()
+
+    def _build_columns(self):
+        """
+        Case-folded metadata codes used to build search masks, derived from the
+        catalog's vocabularies so no Course objects are created.
+        """
+        catalog = self.courses
+
+        def fold(vocab):
+            # lowercase value -> code, plus a map from catalog codes to those codes
+            folded = {v: i for i, v in enumerate(sorted({(v or '').lower() for v in vocab}))}
+            return folded, np.array([folded[(v or '').lower()] for v in vocab], dtype=np.int32)
+
+        self.skill_vocab, skill_map = fold(catalog.skill_levels.vocab)
+        self.provider_vocab, provider_map = fold(catalog.providers.vocab)
+        self.tag_vocab, tag_map = fold(catalog.tag_vocab)
+        self.skill_codes = skill_map[catalog.skill_levels.codes] if len(skill_map) else np.zeros(0, dtype=np.int32)
+        self.provider_codes = provider_map[catalog.providers.codes] if len(provider_map) else np.zeros(0, dtype=np.int32)
+        durations = np.array([parse_duration_hours(v) for v in catalog.durations.vocab], dtype=np.float32)
+        self.duration_hours = durations[catalog.durations.codes] if len(durations) else np.zeros(0, dtype=np.float32)
+        # One bit per tag, packed into 64-bit words
+        self.tag_bits = np.zeros((len(catalog), max(1, (len(self.tag_vocab) + 63) // 64)), dtype=np.uint64)
+        if len(catalog.tag_ids):
+            rows = np.repeat(np.arange(len(catalog)), np.diff(catalog.tag_indptr))
+            tags = tag_map[catalog.tag_ids]
+            np.bitwise_or.at(self.tag_bits, (rows, tags // 64), np.left_shift(np.uint64(1), (tags % 64).astype(np.uint64)))
+
+    @retrieval_stage_seconds.timed("filter")
+    def filter_mask(self, filters: dict) -> np.ndarray:
+        """
+        Boolean row mask for attribute filters: 'skill_levels', 'providers',
+        'tags' (any of) and 'max_duration_hours'. Unknown values match nothing.
+        """
+        mask = np.ones(len(self.courses), dtype=bool)
+        if filters.get('skill_levels'):
+            codes = [self.skill_vocab[v.lower()] for v in filters['skill_levels'] if v.lower() in self.skill_vocab]
+            mask &= np.isin(self.skill_codes, codes)
+        if filters.get('providers'):
+            codes = [self.provider_vocab[v.lower()] for v in filters['providers'] if v.lower() in self.provider_vocab]
+            mask &= np.isin(self.provider_codes, codes)
+        if filters.get('tags'):
+            wanted = np.zeros(self.tag_bits.shape[1], dtype=np.uint64)
+            for tag in filters['tags']:
+                t = self.tag_vocab.get(tag.lower())
+                if t is not None:
+                    wanted[t // 64] |= np.uint64(1 << (t % 64))
+            mask &= (self.tag_bits & wanted).any(axis=1)
+        if filters.get('max_duration_hours') is not None:
+            # Courses with an unparseable duration are left out when filtering on it
+            mask &= self.duration_hours <= filters['max_duration_hours']
+        return mask
+
+    def _exact_search(self, vectors: np.ndarray, allowed: np.ndarray, k: int):
+        """Exact k nearest of `allowed` rows, scanning the embedding matrix BRUTE_FORCE_MAX rows at a time."""
+        top_d = np.zeros((len(vectors), 0), dtype=np.float32)
+        top_i = np.zeros((len(vectors), 0), dtype=np.int64)
+        norms = (vectors ** 2).sum(axis=1)[:, None]
+        for start in range(0, len(allowed), BRUTE_FORCE_MAX):
+            rows = allowed[start:start + BRUTE_FORCE_MAX]
+            candidates = np.asarray(self.embeddings[rows], dtype=np.float32)
+            dists = norms - 2 * vectors @ candidates.T + (candidates ** 2).sum(axis=1)[None, :]
+            top_d = np.hstack([top_d, dists])
+            top_i = np.hstack([top_i, np.broadcast_to(rows, dists.shape)])
+            if top_d.shape[1] > k:
+                keep = np.argpartition(top_d, k - 1, axis=1)[:, :k]
+                top_d = np.take_along_axis(top_d, keep, axis=1)
+                top_i = np.take_along_axis(top_i, keep, axis=1)
+        order = np.argsort(top_d, axis=1)
+        return np.take_along_axis(top_d, order, axis=1), np.take_along_axis(top_i, order, axis=1)
+
+    @retrieval_stage_seconds.timed("vector_search")
+    def _search_masked(self, vectors: np.ndarray, mask: np.ndarray, k: int):
+        allowed = np.flatnonzero(mask)
+        k = min(k, len(allowed))
+        if k == 0:
+            return np.zeros((len(vectors), 0), dtype=np.float32), np.zeros((len(vectors), 0), dtype=np.int64)
+        if len(allowed) <= BRUTE_FORCE_MAX:
+            # Small candidate set: exact distances straight from the embedding matrix
+            return self._exact_search(vectors, allowed, k)
+        D, I = self.index.search(vectors, k, mask)
+        # IVF/HNSW only visit part of the index, so a selective filter can leave
+        # a query with fewer than k hits (-1 padded); those queries are redone exactly
+        short = np.flatnonzero((I < 0).any(axis=1))
+        if len(short):
+            with retrieval_stage_seconds.time("exact_fallback"):
+                D[short], I[short] = self._exact_search(vectors[short], allowed, k)
+        return D, I
+
+    def _mask(self, masks: dict, filters) -> np.ndarray:
+        """filter_mask for `filters`, built once per distinct filter set and kept in `masks`."""
+        key = filter_key(filters)
+        mask = masks.get(key)
+        if mask is None:
+            mask = masks[key] = self.filter_mask(filters or {})
+        return mask
+
+    def search(self, queries, k: int = 5, filters: dict = None, masks: dict = None):
+        """
+        Nearest courses for each query (text or embedding), as lists of
+        (row, L2 distance). `filters` is one dict for all queries or a list
+        with one per query, holding attribute filters (see filter_mask) and
+        'exclude_ids'. Filters are applied inside the search via a FAISS ID
+        selector (or an exact scan when few rows qualify). Approximate
+        backends can miss qualifying rows, so a query they return short is
+        redone as an exact scan over the qualifying rows; each query gets k
+        results whenever k courses qualify. `masks` (filter_key -> mask) lets
+        a caller reuse the masks built here; they are left as found.
+        """
+        vectors = self.encode(queries)
+        if len(self.courses) == 0:
+            return [[] for _ in range(len(vectors))]
+        per_query = filters if isinstance(filters, list) else [filters] * len(vectors)
+        if not any(per_query):
+            with retrieval_stage_seconds.time("vector_search"):
+                D, I = self.index.search(vectors, min(k, len(self.courses)))
+            return [[(int(i), float(d)) for d, i in zip(ds, ids) if i >= 0] for ds, ids in zip(D, I)]
+
+        # Queries sharing attribute filters share one mask and one multi-query search
+        groups = {}
+        for q, query_filters in enumerate(per_query):
+            groups.setdefault(filter_key(query_filters), []).append(q)
+
+        results = [None] * len(vectors)
+        masks = {} if masks is None else masks
+        for group in groups.values():
+            mask = self._mask(masks, per_query[group[0]])
+            excluded = [
+                [self.rows[cid] for cid in (per_query[q] or {}).get('exclude_ids', ()) if cid in self.rows]
+                for q in group
+            ]
+            if len(group) == 1:
+                # Single query: exclusions go straight into the selector (and are undone after)
+                was_allowed = mask[excluded[0]]
+                mask[excluded[0]] = False
+                try:
+                    D, I = self._search_masked(vectors[group], mask, k)
+                finally:
+                    mask[excluded[0]] = was_allowed
+            else:
+                # Shared selector: fetch enough extra rows to cover each query's own exclusions
+                extra = max(int(mask[rows].sum()) if rows else 0 for rows in excluded)
+                D, I = self._search_masked(vectors[group], mask, k + extra)
+            for q, rows, ds, ids in zip(group, excluded, D, I):
+                skip = set(rows)
+                results[q] = [(int(i), float(d)) for d, i in zip(ds, ids) if i >= 0 and int(i) not in skip][:k]
+        return results
+
+
+    @retrieval_stage_seconds.timed("collaborative")
+    def collaborative_scores(self, user_ids):
+        """
+        Predicted affinity of each user for every course from the latest
+        collaborative model, as an (n_users, n_courses) array; rows are None
+        for users the model has not seen. None when no model is trained.
+        """
+        model = get_factor_model()
+        if model is None:
+            return None
+        source, course_factors = self._cf
+        if source is not model:
+            # Align the model's course factors with this index's rows; unseen courses score 0
+            course_factors = np.zeros((len(self.courses), model.course_factors.shape[1]), dtype=np.float32)
+            for course_id, row in self.rows.items():
+                j = model.course_rows.get(course_id)
+                if j is not None:
+                    course_factors[row] = model.course_factors[j]
+            self._cf = (model, course_factors)
+        return [
+            course_factors @ model.user_factors[model.user_rows[user_id]] if user_id in model.user_rows else None
+            for user_id in user_ids
+        ]
+
+    def hybrid_search(self, texts, k: int = 5, filters: dict = None, vectors: np.ndarray = None, user_ids=None):
+        """
+        Fuse dense (FAISS) and lexical (BM25) rankings with reciprocal rank
+        fusion. `texts` are the query strings; `vectors` optionally supplies
+        their (e.g. feedback-adjusted) embeddings, otherwise they are encoded
+        here. Falls back to BM25 alone when no embeddings are available.
+        With `user_ids`, the collaborative ranking for each user is fused in
+        too, weighted by CF_WEIGHT. Returns lists of (row, fused score), best
+        first; higher scores are better (unlike the L2 distances of search()).
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        per_query = filters if isinstance(filters, list) else [filters] * len(texts)
+        if RETRIEVAL_MODE == "dense":
+            vectors = self.encode(texts) if vectors is None else vectors
+            # Scored like a one-ranking fusion, so scores mean the same in every mode
+            return [[(row, 1.0 / (RRF_K + rank + 1)) for rank, (row, _) in enumerate(hits)]
+                    for hits in self.search(vectors, k=k, filters=per_query)]
+        if RETRIEVAL_MODE == "lexical":
+            vectors = None
+        elif vectors is None:
+            vectors = self.try_encode(texts)
+
+        candidates = max(k, HYBRID_CANDIDATES)
+        # One mask per distinct filter set in the batch, shared with the dense search
+        masks = {}
+        dense = (self.search(vectors, k=candidates, filters=per_query, masks=masks) if vectors is not None
+                 else [[]] * len(texts))
+        collaborative = self.collaborative_scores(user_ids) if user_ids is not None else None
+        results = []
+        for q, (text, query_filters, dense_hits) in enumerate(zip(texts, per_query, dense)):
+            query_filters = query_filters or {}
+            # Exclusions are applied to the shared mask and undone in place
+            mask = self._mask(masks, query_filters)
+            excluded = [self.rows[cid] for cid in query_filters.get('exclude_ids', ()) if cid in self.rows]
+            was_allowed = mask[excluded]
+            mask[excluded] = False
+            with retrieval_stage_seconds.time("lexical"):
+                rankings = [(1.0, dense_hits), (1.0, self.lexical.search(text, candidates, mask))]
+            if collaborative is not None and collaborative[q] is not None:
+                scores = np.where(mask, collaborative[q], 0.0)
+                top = np.flatnonzero(scores > 0)
+                if len(top) > candidates:
+                    top = top[np.argpartition(-scores[top], candidates - 1)[:candidates]]
+                top = top[np.argsort(-scores[top], kind='stable')]
+                rankings.append((CF_WEIGHT, [(int(row), float(scores[row])) for row in top]))
+            mask[excluded] = was_allowed
+            fused = {}
+            for weight, ranking in rankings:
+                for rank, (row, _) in enumerate(ranking):
+                    fused[row] = fused.get(row, 0.0) + weight / (RRF_K + rank + 1)
+            results.append(sorted(fused.items(), key=lambda item: -item[1])[:k])
+        return results
+
+
+def _reload_course_index(version):
+    """Build the index for a new catalog version off the request path, then swap it in."""
+    global _course_index, _reloading
+    try:
+        start = time.perf_counter()
+        course_index = CourseIndex(load_catalog(), get_model(), version)
+        _course_index = course_index
+        print(f"Reloaded course index (catalog version {version}) in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"Course index reload failed, still serving the previous catalog: {e}")
+    finally:
+        _reloading = False
+
+
+def get_course_index() -> CourseIndex:
+    """
+    Lazily built, process-wide CourseIndex. At most every
+    RELOAD_CHECK_SECONDS it checks whether the catalog in SQLite has changed;
+    if so a background thread builds the new index (thanks to the embedding
+    store only changed courses are re-encoded) while requests keep being
+    served from the current one, which is replaced once the build is done.
+    """
+    global _course_index, _checked_at, _reloading
+    now = time.monotonic()
+    if _course_index is not None and now - _checked_at < RELOAD_CHECK_SECONDS:
+        return _course_index
+    with _index_lock:
+        if _course_index is None:
+            version = get_catalog_version()
+            print("Loading course index")
+            _course_index = CourseIndex(load_catalog(), get_model(), version)
+            print("Embedded courses successfully")
+            _checked_at = time.monotonic()
+        elif now - _checked_at >= RELOAD_CHECK_SECONDS:
+            _checked_at = time.monotonic()
+            if not _reloading:
+                version = get_catalog_version()
+                if version != _course_index.catalog_version:
+                    _reloading = True
+                    threading.Thread(target=_reload_course_index, args=(version,),
+                                     name="course-index-reload", daemon=True).start()
+    return _course_index
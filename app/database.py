@@ -1,142 +1,509 @@
 import sqlite3
 import os
 import json
+import time
+import hashlib
+import queue
+import threading
+from collections import deque
+from contextlib import contextmanager
+from pydantic import ValidationError
 from app.models import Course
+from app.metrics import sqlite_query_seconds
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'feedback.db')
-DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'courses.json')
+DB_PATH = os.getenv("FEEDBACK_DB_PATH", os.path.join(os.path.dirname(__file__), 'feedback.db'))
+CONVO_DB_PATH = os.getenv("CONVERSATIONS_DB_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'conversations.db'))
+DATA_PATH = os.getenv("COURSES_DATA_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'courses.json'))
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+# Connections kept open per database file, and how long a writer waits on a lock
+POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Recent samples kept per query type for the p50/p99 figures
+TIMING_SAMPLES = 2048
+
+# SQL is kept in constants so each pooled connection's statement cache reuses the compiled form
+SQL_SAVE_FEEDBACK = 'INSERT OR REPLACE INTO feedback (user_id, course_id, feedback) VALUES (?, ?, ?)'
+SQL_USER_FEEDBACK = 'SELECT course_id, feedback FROM feedback WHERE user_id = ?'
+SQL_ALL_FEEDBACK = 'SELECT user_id, course_id, feedback FROM feedback'
+SQL_FEEDBACK_VALUE = 'SELECT feedback FROM feedback WHERE user_id = ? AND course_id = ?'
+SQL_USER_FEEDBACK_COUNT = 'SELECT COUNT(*) FROM feedback WHERE user_id = ?'
+SQL_FEEDBACK_USERS = 'SELECT DISTINCT user_id FROM feedback'
+SQL_BUMP_FEEDBACK_VERSION = '''
+    INSERT INTO feedback_versions (user_id, version) VALUES (?, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+'''
+SQL_USER_VECTORS = '''
+    SELECT user_id, fingerprint, liked_sum, liked_count, disliked_sum, disliked_count
+    FROM user_vectors WHERE user_id = ?
+'''
+SQL_UPSERT_USER_VECTORS = '''
+    INSERT INTO user_vectors (user_id, fingerprint, liked_sum, liked_count, disliked_sum, disliked_count)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        fingerprint = excluded.fingerprint, liked_sum = excluded.liked_sum, liked_count = excluded.liked_count,
+        disliked_sum = excluded.disliked_sum, disliked_count = excluded.disliked_count
+'''
+SQL_ALL_COURSES = 'SELECT id, title, description, skill_level, tags, duration, url, provider FROM courses'
+SQL_UPSERT_COURSE = '''
+    INSERT INTO courses (id, title, description, skill_level, tags, duration, url, provider, content_hash)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        title = excluded.title, description = excluded.description, skill_level = excluded.skill_level,
+        tags = excluded.tags, duration = excluded.duration, url = excluded.url,
+        provider = excluded.provider, content_hash = excluded.content_hash
+'''
+SQL_BUMP_CATALOG_VERSION = '''
+    INSERT INTO catalog_meta (key, value) VALUES ('version', 1)
+    ON CONFLICT(key) DO UPDATE SET value = value + 1
+'''
+SQL_CATALOG_VERSION = "SELECT value FROM catalog_meta WHERE key = 'version'"
+SQL_SAVE_CONVERSATION = 'INSERT INTO conversations (thread_id, user_id, query, response) VALUES (?, ?, ?, ?)'
+# Served from idx_conversations_thread_time; rowid breaks ties between turns in the same second
+SQL_RECENT_CONVERSATIONS = 'SELECT query, response FROM conversations WHERE thread_id = ? ORDER BY timestamp DESC, rowid DESC LIMIT ?'
+# Threads (after a thread_id cursor) whose newest turn is older than the cutoff
+SQL_STALE_THREADS = '''
+    SELECT thread_id FROM conversations WHERE thread_id > ?
+    GROUP BY thread_id HAVING MAX(timestamp) < ? ORDER BY thread_id LIMIT ?
+'''
+SQL_DELETE_THREAD_BEFORE = 'DELETE FROM conversations WHERE thread_id = ? AND timestamp < ?'
+
+
+def _configure(conn):
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
     return conn
 
+
+class ConnectionPool:
+    """
+    Fixed-size pool of SQLite connections to one database file. Connections are
+    opened lazily in WAL mode and shared across threads one borrower at a time.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.Semaphore(size)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256,
+                               timeout=BUSY_TIMEOUT_MS / 1000)
+        return _configure(conn)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._idle.put_nowait(conn)
+        finally:
+            self._slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=DB_PATH) -> ConnectionPool:
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, ConnectionPool(path))
+    return pool
+
+
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def connection(query_type, path=DB_PATH):
+    """Borrow a pooled connection and record how long the work under query_type took."""
+    start = time.perf_counter()
+    try:
+        with get_pool(path).connection() as conn:
+            yield conn
+    finally:
+        elapsed = time.perf_counter() - start
+        with _timings_lock:
+            _timings.setdefault(query_type, deque(maxlen=TIMING_SAMPLES)).append(elapsed)
+        sqlite_query_seconds.observe(elapsed, query_type)
+
+
+def get_query_stats():
+    """Per query type: sample count plus p50/p99 latency in milliseconds over recent calls."""
+    with _timings_lock:
+        snapshot = {name: sorted(samples) for name, samples in _timings.items()}
+    stats = {}
+    for name, samples in snapshot.items():
+        n = len(samples)
+        stats[name] = {
+            "count": n,
+            "p50_ms": round(samples[int(0.50 * (n - 1))] * 1000, 3),
+            "p99_ms": round(samples[int(0.99 * (n - 1))] * 1000, 3),
+        }
+    return stats
+
+
+def get_db_connection():
+    """Standalone connection with the same pragmas as the pool, for scripts and one-off jobs."""
+    return _configure(sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000))
+
 def init_feedback_db():
-    conn = get_db_connection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS feedback (
-            user_id TEXT NOT NULL,
-            course_id TEXT NOT NULL,
-            feedback TEXT NOT NULL,
-            PRIMARY KEY (user_id, course_id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with connection('init') as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS feedback (
+                user_id TEXT NOT NULL,
+                course_id TEXT NOT NULL,
+                feedback TEXT NOT NULL,
+                PRIMARY KEY (user_id, course_id)
+            )
+        ''')
+        # Running sums of liked/disliked course embeddings per user (float32 blobs), valid
+        # only for the course index whose fingerprint they were computed against
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_vectors (
+                user_id TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                liked_sum BLOB NOT NULL,
+                liked_count INTEGER NOT NULL,
+                disliked_sum BLOB NOT NULL,
+                disliked_count INTEGER NOT NULL
+            )
+        ''')
+        # Bumped on every feedback write so cached recommendations for that user go stale
+        conn.execute('CREATE TABLE IF NOT EXISTS feedback_versions (user_id TEXT PRIMARY KEY, version INTEGER NOT NULL)')
 
 def init_courses_db():
-    conn = get_db_connection()
-    conn.execute('''
-        CREATE TABLE IF NOT EXISTS courses (
-            id TEXT PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            skill_level TEXT NOT NULL,
-            tags TEXT NOT NULL,
-            duration TEXT NOT NULL,
-            url TEXT NOT NULL,
-            provider TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def dump_courses_to_database():
-    print("dumping courses to db")
-    # Only insert if table is empty
-    conn = get_db_connection()
-    count = conn.execute('SELECT COUNT(*) FROM courses').fetchone()[0]
-    if count == 0:
-        with open(DATA_PATH, 'r', encoding='utf-8') as f:
-            raw_courses = json.load(f)
-        for course in raw_courses:
-            conn.execute('''
-                INSERT INTO courses (id, title, description, skill_level, tags, duration, url, provider)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                course['id'],
-                course['title'],
-                course['description'],
-                course['skill_level'],
-                json.dumps(course['tags']),
-                course['duration'],
-                course['url'],
-                course.get('provider')
-            ))
-        conn.commit()
-    conn.close()
-
-
-def dump_courses_to_db():
-    print("dumping courses to db")
-    conn = get_db_connection()
-    with open(DATA_PATH, 'r', encoding='utf-8') as f:
-        raw_courses = json.load(f)
-    for course in raw_courses:
+    with connection('init') as conn:
         conn.execute('''
-            INSERT OR IGNORE INTO courses (id, title, description, skill_level, tags, duration, url, provider)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            course['id'],
-            course['title'],
-            course['description'],
-            course['skill_level'],
-            json.dumps(course['tags']),
-            course['duration'],
-            course['url'],
-            course.get('provider')
-        ))
-    conn.commit()
-    conn.close()
+            CREATE TABLE IF NOT EXISTS courses (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT NOT NULL,
+                skill_level TEXT NOT NULL,
+                tags TEXT NOT NULL,
+                duration TEXT NOT NULL,
+                url TEXT NOT NULL,
+                provider TEXT,
+                content_hash TEXT
+            )
+        ''')
+        # Databases created before content hashing lack the column; NULL hashes get re-ingested once
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(courses)')}
+        if 'content_hash' not in columns:
+            conn.execute('ALTER TABLE courses ADD COLUMN content_hash TEXT')
+        conn.execute('CREATE TABLE IF NOT EXISTS ingest_state (path TEXT PRIMARY KEY, state TEXT NOT NULL)')
+        # Ids removed with delete_courses; a full ingest of the catalog file doesn't bring them back
+        conn.execute('CREATE TABLE IF NOT EXISTS deleted_courses (id TEXT PRIMARY KEY)')
+        # Bumped on every catalog change so running workers know to refresh their course index
+        conn.execute('CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        if conn.execute("SELECT 1 FROM catalog_meta WHERE key = 'rows_validated'").fetchone() is None:
+            _validate_stored_courses(conn)
+
+def _validate_stored_courses(conn):
+    """
+    One-time migration: rows ingested before ingest-time validation existed
+    are validated once and the invalid ones removed, so catalog loads can
+    build Course objects without validating.
+    """
+    invalid = []
+    for row in conn.execute(SQL_ALL_COURSES):
+        course = dict(row)
+        try:
+            course['tags'] = json.loads(course['tags'])
+            Course.model_validate(course)
+        except (ValueError, TypeError) as e:
+            print(f"Removing invalid stored course {course['id']!r}: {e}")
+            invalid.append((course['id'],))
+    conn.executemany('DELETE FROM courses WHERE id = ?', invalid)
+    if invalid:
+        conn.execute(SQL_BUMP_CATALOG_VERSION)
+    conn.execute("INSERT OR REPLACE INTO catalog_meta (key, value) VALUES ('rows_validated', 1)")
+
+COURSE_FIELDS = ('id', 'title', 'description', 'skill_level', 'tags', 'duration', 'url', 'provider')
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+
+def _course_row(course, content_hash):
+    return (
+        course['id'],
+        course['title'],
+        course['description'],
+        course['skill_level'],
+        json.dumps(course['tags']),
+        course['duration'],
+        course['url'],
+        course.get('provider'),
+        content_hash
+    )
+
+def course_content_hash(course) -> str:
+    payload = json.dumps({field: course.get(field) for field in COURSE_FIELDS}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def iter_catalog(path=DATA_PATH, chunk_size=1 << 16):
+    """
+    Yield course dicts one at a time from a JSON array or an NDJSON file
+    (.ndjson/.jsonl) without loading the whole file into memory.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.ndjson', '.jsonl')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ''
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            # Skip whitespace and array punctuation between objects
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,[]':
+                if buffer[pos] == '[':
+                    started = True
+                pos += 1
+            if pos < len(buffer):
+                if not started:
+                    raise ValueError(f"{path} is not a JSON array of courses")
+                try:
+                    course, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield course
+                    pos = end
+                    continue
+            if eof:
+                return
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+def _catalog_file_state(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+def ingest_courses(path=DATA_PATH, batch_size=INGEST_BATCH_SIZE, full=True):
+    """
+    Stream the catalog file into the courses table and return the ids of
+    courses that were inserted or changed. Rows are upserted in executemany
+    batches inside one transaction, and only when their content hash differs
+    from the stored one. If the file is unchanged since the last ingest
+    (same size and mtime) nothing is read at all.
+
+    With `full` the file is the whole catalog: courses no longer in it are
+    removed, and courses removed with delete_courses are skipped. Otherwise
+    it only adds or updates the courses it lists, un-deleting any of them.
+    """
+    file_state = _catalog_file_state(path)
+    with connection('ingest_courses') as conn:
+        row = conn.execute('SELECT state FROM ingest_state WHERE path = ?', (path,)).fetchone()
+        if row is not None and row['state'] == file_state:
+            print("Course catalog unchanged, skipping ingest")
+            return set()
+
+        known = dict(conn.execute('SELECT id, content_hash FROM courses').fetchall())
+        deleted = {row['id'] for row in conn.execute('SELECT id FROM deleted_courses')}
+        seen = set()
+        changed = set()
+        batch = []
+        invalid = 0
+        for course in iter_catalog(path):
+            course_id = course.get('id')
+            if full and course_id in deleted:
+                continue
+            # An invalid edit keeps the previously stored version, so it counts as present
+            seen.add(course_id)
+            content_hash = course_content_hash(course)
+            if known.get(course_id) == content_hash:
+                continue
+            # Validated once here, so readers can build Course objects without re-validating
+            try:
+                Course.model_validate(course)
+            except ValidationError as e:
+                invalid += 1
+                print(f"Skipping invalid course {course_id!r}: {e.errors()[0]['msg']}")
+                continue
+            known[course['id']] = content_hash
+            changed.add(course['id'])
+            batch.append(_course_row(course, content_hash))
+            if len(batch) >= batch_size:
+                conn.executemany(SQL_UPSERT_COURSE, batch)
+                batch = []
+        if batch:
+            conn.executemany(SQL_UPSERT_COURSE, batch)
+        removed = [course_id for course_id in known if course_id not in seen] if full else []
+        conn.executemany('DELETE FROM courses WHERE id = ?', [(course_id,) for course_id in removed])
+        if not full:
+            conn.executemany('DELETE FROM deleted_courses WHERE id = ?', [(course_id,) for course_id in seen & deleted])
+        if changed or removed:
+            conn.execute(SQL_BUMP_CATALOG_VERSION)
+        conn.execute('INSERT OR REPLACE INTO ingest_state (path, state) VALUES (?, ?)', (path, file_state))
+    print(f"Ingested course catalog: {len(changed)} new or changed, {len(removed)} removed, {invalid} invalid skipped")
+    return changed
+
+def delete_courses(course_ids):
+    """
+    Remove courses by id and remember them, so later full ingests of the
+    catalog file keep them out; returns how many rows were deleted.
+    """
+    with connection('delete_courses') as conn:
+        deleted = conn.executemany('DELETE FROM courses WHERE id = ?', [(cid,) for cid in course_ids]).rowcount
+        conn.executemany('INSERT OR IGNORE INTO deleted_courses (id) VALUES (?)', [(cid,) for cid in course_ids])
+        if deleted:
+            conn.execute(SQL_BUMP_CATALOG_VERSION)
+    return deleted
+
+def bump_catalog_version():
+    """Make running servers reload the course index (e.g. after it was retrained) without a catalog change."""
+    with connection('bump_catalog_version') as conn:
+        conn.execute(SQL_BUMP_CATALOG_VERSION)
+
+def get_catalog_version():
+    with connection('get_catalog_version') as conn:
+        row = conn.execute(SQL_CATALOG_VERSION).fetchone()
+    return row['value'] if row else 0
 
 
 # Initialize SQLite for conversation persistence
 def init_convo_db():
-    conn = sqlite3.connect('conversations.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS conversations
-                 (thread_id TEXT, user_id TEXT, query TEXT, response TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    conn.commit()
-    conn.close()
+    with connection('init', CONVO_DB_PATH) as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS conversations
+                     (thread_id TEXT, user_id TEXT, query TEXT, response TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_conversations_thread_time ON conversations (thread_id, timestamp)')
 
 
 def init_db():
+    """Create tables and ingest the catalog; returns the ids of new or changed courses."""
     init_courses_db()
-    dump_courses_to_db()
+    changed_course_ids = ingest_courses()
     init_feedback_db()
     init_convo_db()
+    return changed_course_ids
 
 def save_feedback(user_id, course_id, feedback):
-    conn = get_db_connection()
-    conn.execute('''
-        INSERT OR REPLACE INTO feedback (user_id, course_id, feedback)
-        VALUES (?, ?, ?)
-    ''', (user_id, course_id, feedback))
-    conn.commit()
-    conn.close()
+    with connection('save_feedback') as conn:
+        conn.execute(SQL_SAVE_FEEDBACK, (user_id, course_id, feedback))
+        conn.execute(SQL_BUMP_FEEDBACK_VERSION, (user_id,))
 
 def get_user_feedback(user_id):
-    conn = get_db_connection()
-    rows = conn.execute('SELECT course_id, feedback FROM feedback WHERE user_id = ?', (user_id,)).fetchall()
-    conn.close()
+    with connection('get_user_feedback') as conn:
+        rows = conn.execute(SQL_USER_FEEDBACK, (user_id,)).fetchall()
     return {row['course_id']: row['feedback'] for row in rows}
 
+def get_feedback_for_users(user_ids):
+    """Feedback for many users in one round-trip: {user_id: {course_id: feedback}}."""
+    user_ids = list(dict.fromkeys(user_ids))
+    result = {user_id: {} for user_id in user_ids}
+    with connection('get_feedback_for_users') as conn:
+        # Stay under SQLite's default bound-parameter limit
+        for start in range(0, len(user_ids), 900):
+            chunk = user_ids[start:start + 900]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT user_id, course_id, feedback FROM feedback WHERE user_id IN ({placeholders})', chunk
+            ).fetchall()
+            for row in rows:
+                result[row['user_id']][row['course_id']] = row['feedback']
+    return result
+
+def get_feedback_versions(user_ids):
+    """{user_id: feedback version}; users who never left feedback are at version 0."""
+    user_ids = list(dict.fromkeys(user_ids))
+    versions = dict.fromkeys(user_ids, 0)
+    with connection('get_feedback_versions') as conn:
+        for start in range(0, len(user_ids), 900):
+            chunk = user_ids[start:start + 900]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT user_id, version FROM feedback_versions WHERE user_id IN ({placeholders})', chunk
+            ).fetchall()
+            versions.update((row['user_id'], row['version']) for row in rows)
+    return versions
+
 def get_all_feedback():
-    conn = get_db_connection()
-    rows = conn.execute('SELECT user_id, course_id, feedback FROM feedback').fetchall()
-    conn.close()
+    with connection('get_all_feedback') as conn:
+        rows = conn.execute(SQL_ALL_FEEDBACK).fetchall()
     result = {}
     for row in rows:
         result.setdefault(row['user_id'], {})[row['course_id']] = row['feedback']
     return result
 
+def iter_feedback_chunks(chunk_size=10000):
+    """Stream the whole feedback table from one cursor, chunk_size rows at a time."""
+    with connection('iter_feedback') as conn:
+        cursor = conn.execute(SQL_ALL_FEEDBACK)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+def iter_course_rows(chunk_size=10000):
+    """Stream the courses table as plain dicts (tags decoded), chunk_size rows per fetch."""
+    with connection('iter_courses') as conn:
+        cursor = conn.execute(SQL_ALL_COURSES)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            for row in rows:
+                course = dict(row)
+                course['tags'] = json.loads(course['tags'])
+                yield course
+
 def get_all_courses():
-    conn = get_db_connection()
-    rows = conn.execute('SELECT * FROM courses').fetchall()
-    conn.close()
+    with connection('get_all_courses') as conn:
+        rows = conn.execute(SQL_ALL_COURSES).fetchall()
     courses = []
     for row in rows:
         course_dict = dict(row)
         course_dict['tags'] = json.loads(course_dict['tags'])
         courses.append(Course(**course_dict))
     return courses
+
+def save_conversation(thread_id, user_id, query, response):
+    with connection('save_conversation', CONVO_DB_PATH) as conn:
+        conn.execute(SQL_SAVE_CONVERSATION, (thread_id, user_id, query, response))
+
+def get_recent_conversations(thread_id, limit=3):
+    with connection('get_recent_conversations', CONVO_DB_PATH) as conn:
+        rows = conn.execute(SQL_RECENT_CONVERSATIONS, (thread_id, limit)).fetchall()
+    return [{"query": row['query'], "response": row['response']} for row in rows]
+
+def archive_conversation_chunk(cutoff, after_thread_id, limit, archive):
+    """
+    Move up to `limit` threads whose last turn is older than `cutoff` (after
+    the `after_thread_id` cursor) out of the conversations table. Inside one
+    write transaction their turns go to archive.add(thread_id, rows), then
+    archive.sync() must make them durable before the rows are deleted, so a
+    failure leaves them in place. Returns the archived thread ids.
+    """
+    with connection('archive_conversations', CONVO_DB_PATH) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        thread_ids = [row['thread_id'] for row in conn.execute(SQL_STALE_THREADS, (after_thread_id, cutoff, limit))]
+        for thread_id in thread_ids:
+            rows = conn.execute(
+                'SELECT user_id, query, response, timestamp FROM conversations '
+                'WHERE thread_id = ? AND timestamp < ? ORDER BY timestamp, rowid', (thread_id, cutoff)
+            ).fetchall()
+            archive.add(thread_id, rows)
+        archive.sync()
+        conn.executemany(SQL_DELETE_THREAD_BEFORE, [(thread_id, cutoff) for thread_id in thread_ids])
+    return thread_ids
@@ -0,0 +1,126 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+
+# Largest batch sent to the model, and how long the first queued text may wait for company
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+# torch intra-op threads used by the encode worker (0 leaves torch's default)
+EMBED_TORCH_THREADS = int(os.getenv("EMBED_TORCH_THREADS", "0"))
+
+
+class EmbeddingService:
+    """
+    Micro-batches encode calls from all request handlers. Texts are queued
+    with a Future each; one worker thread flushes a batch as soon as it holds
+    EMBED_MAX_BATCH texts or the oldest text has waited EMBED_MAX_WAIT_MS,
+    runs a single model.encode and resolves the futures. It never waits when
+    every caller currently inside encode() is already in the batch, so a
+    lone request pays no batching delay.
+    """
+
+    def __init__(self, model, max_batch=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS,
+                 torch_threads=EMBED_TORCH_THREADS):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.torch_threads = torch_threads
+        self._queue = queue.Queue()
+        self._callers = 0
+        self._callers_lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str, caller=None) -> Future:
+        future = Future()
+        self._queue.put((time.monotonic(), caller, text, future))
+        return future
+
+    def encode(self, texts, normalize: bool = False) -> np.ndarray:
+        """Embeddings for `texts` as a float32 (n, dim) array, batched with whatever else is queued."""
+        if not texts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        caller = object()
+        with self._callers_lock:
+            self._callers += 1
+        try:
+            futures = [self.submit(text, caller) for text in texts]
+            vectors = np.stack([future.result() for future in futures])
+        finally:
+            with self._callers_lock:
+                self._callers -= 1
+        if normalize:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def _next_batch(self):
+        enqueued_at, caller, text, future = self._queue.get()
+        batch = [(text, future)]
+        callers = {id(caller)}
+        deadline = enqueued_at + self.max_wait
+        while len(batch) < self.max_batch:
+            # Nobody else is encoding: waiting could only add latency
+            waiting = len(callers) < self._callers and deadline > time.monotonic()
+            try:
+                # Whatever is already queued is taken even past the deadline
+                if waiting:
+                    _, caller, text, future = self._queue.get(timeout=deadline - time.monotonic())
+                else:
+                    _, caller, text, future = self._queue.get_nowait()
+            except (queue.Empty, ValueError):
+                break
+            batch.append((text, future))
+            callers.add(id(caller))
+        return batch
+
+    def _run(self):
+        if self.torch_threads > 0:
+            try:
+                import torch
+                torch.set_num_threads(self.torch_threads)
+            except ImportError:
+                pass
+        while True:
+            batch = [(text, future) for text, future in self._next_batch() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                vectors = np.asarray(
+                    self.model.encode([text for text, _ in batch], batch_size=len(batch), convert_to_numpy=True),
+                    dtype=np.float32,
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(batch)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                from app.course_index import get_model
+                _service = EmbeddingService(get_model())
+    return _service
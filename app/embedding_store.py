@@ -0,0 +1,130 @@
+import os
+import re
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'embedding_cache')
+)
+EMBED_BATCH_SIZE = int(os.getenv("INDEX_EMBED_BATCH_SIZE", "256"))
+EMBED_WORKERS = int(os.getenv("INDEX_EMBED_WORKERS", "2"))
+
+
+def course_text(course) -> str:
+    """Text used to embed a course: title + description + tags."""
+    return f"{course.title} {course.description} {' '.join(course.tags)}"
+
+
+def text_hash(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode('utf-8')).hexdigest()
+
+
+def catalog_fingerprint(model_name: str, texts) -> str:
+    """Identifies an exact, ordered set of course embeddings (used to key derived indexes)."""
+    digest = hashlib.sha256(model_name.encode('utf-8'))
+    for t in texts:
+        digest.update(text_hash(model_name, t).encode('ascii'))
+    return digest.hexdigest()
+
+
+def _store_paths(model_name: str):
+    slug = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+    return (
+        os.path.join(CACHE_DIR, f"{slug}.npy"),
+        os.path.join(CACHE_DIR, f"{slug}.keys.json"),
+    )
+
+
+def load_store(model_name: str):
+    """
+    Load the cached vectors for a model. Vectors are memory-mapped read-only,
+    so an unchanged catalog costs no encode and no full read into memory.
+    Returns (keys, vectors) or ([], None) if there is no usable store.
+    """
+    vectors_path, keys_path = _store_paths(model_name)
+    if not (os.path.exists(vectors_path) and os.path.exists(keys_path)):
+        return [], None
+    try:
+        with open(keys_path, 'r', encoding='utf-8') as f:
+            keys = json.load(f)
+        vectors = np.load(vectors_path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        print(f"Embedding cache unreadable, rebuilding: {e}")
+        return [], None
+    if vectors.ndim != 2 or len(keys) != vectors.shape[0]:
+        print("Embedding cache is inconsistent, rebuilding")
+        return [], None
+    return keys, vectors
+
+
+def save_store(model_name: str, keys, vectors: np.ndarray):
+    """Atomically replace the store so concurrent workers never read a partial file."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    vectors_path, keys_path = _store_paths(model_name)
+    pid = os.getpid()
+    tmp_vectors = f"{vectors_path}.{pid}.tmp.npy"
+    tmp_keys = f"{keys_path}.{pid}.tmp"
+    np.save(tmp_vectors, np.ascontiguousarray(vectors, dtype=np.float32))
+    with open(tmp_keys, 'w', encoding='utf-8') as f:
+        json.dump(list(keys), f)
+    # Vectors first: a reader that sees new keys with old vectors fails the
+    # length check above and simply re-encodes.
+    os.replace(tmp_vectors, vectors_path)
+    os.replace(tmp_keys, keys_path)
+
+
+def embed_texts(model, texts, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS) -> np.ndarray:
+    """Encode texts in batches, running up to `workers` batches concurrently."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    def encode(batch):
+        return model.encode(batch, batch_size=batch_size, convert_to_numpy=True)
+
+    if workers > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(encode, batches))
+    else:
+        parts = [encode(b) for b in batches]
+    return np.asarray(np.vstack(parts), dtype=np.float32)
+
+
+def encode_with_cache(model, model_name: str, texts, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS) -> np.ndarray:
+    """
+    Encode texts, reusing vectors from the on-disk store keyed by
+    hash(model_name + text). Only new or changed texts go through the model.
+    The store is rewritten to mirror the current catalog order, so on the next
+    start with no churn the memory-mapped array is returned as-is.
+    """
+    hashes = [text_hash(model_name, t) for t in texts]
+    cached_keys, cached_vectors = load_store(model_name)
+
+    if cached_vectors is not None and cached_keys == hashes:
+        print(f"Loaded {len(hashes)} course embeddings from cache")
+        return cached_vectors
+
+    row_of = {k: i for i, k in enumerate(cached_keys)}
+    hit_pos = [i for i, h in enumerate(hashes) if h in row_of]
+    miss_pos = [i for i, h in enumerate(hashes) if h not in row_of]
+
+    new_vectors = None
+    if miss_pos:
+        new_vectors = embed_texts(model, [texts[i] for i in miss_pos], batch_size, workers)
+    dim = (
+        cached_vectors.shape[1] if cached_vectors is not None and hit_pos
+        else new_vectors.shape[1] if new_vectors is not None
+        else model.get_sentence_embedding_dimension()
+    )
+
+    embeddings = np.empty((len(texts), dim), dtype=np.float32)
+    if hit_pos:
+        embeddings[hit_pos] = cached_vectors[[row_of[hashes[i]] for i in hit_pos]]
+    if miss_pos:
+        embeddings[miss_pos] = new_vectors
+
+    print(f"Course embeddings: {len(hit_pos)} cached, {len(miss_pos)} encoded")
+    save_store(model_name, hashes, embeddings)
+    return embeddings
@@ -0,0 +1,131 @@
+import os
+import re
+import numpy as np
+from app.embedding_store import CACHE_DIR, catalog_fingerprint
+
+# BM25 term-frequency saturation and length normalisation
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_INDEX_FILE_RE = re.compile(r"bm25-[0-9a-f]{16}\.npz")
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#]*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from how i in into is it of on or so that the this to "
+    "what with you your me my we our about".split()
+)
+
+
+def tokenize(text: str):
+    """Lowercased word tokens; keeps c++/c# intact and drops common stopwords."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over the course texts. Postings are stored
+    as CSR arrays (term -> doc rows) with the BM25 weight of every posting
+    precomputed, so scoring a query is one bincount over its terms' postings.
+    """
+
+    def __init__(self, terms, indptr, doc_ids, tfs, doc_len):
+        self.terms = {t: i for i, t in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.n_docs = len(doc_len)
+        avg_len = float(doc_len.mean()) if self.n_docs else 0.0
+        df = np.diff(indptr).astype(np.float32)
+        idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[doc_ids] / max(avg_len, 1e-9))
+        tf = tfs.astype(np.float32)
+        self.weights = (np.repeat(idf, np.diff(indptr)) * tf * (BM25_K1 + 1.0) / (tf + norm)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts):
+        postings = {}
+        doc_len = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[row] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[row] = counts.get(row, 0) + 1
+        terms = sorted(postings)
+        sizes = [len(postings[t]) for t in terms]
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(sizes)
+        doc_ids = np.fromiter((row for t in terms for row in postings[t]), dtype=np.int32, count=int(indptr[-1]))
+        tfs = np.fromiter((tf for t in terms for tf in postings[t].values()), dtype=np.uint16, count=int(indptr[-1]))
+        return cls(terms, indptr, doc_ids, tfs, doc_len)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path, terms=np.array(list(self.terms), dtype=str), indptr=self.indptr,
+            doc_ids=self.doc_ids, tfs=self.tfs, doc_len=self.doc_len,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['terms'].tolist(), data['indptr'], data['doc_ids'], data['tfs'], data['doc_len'])
+
+    def scores(self, text: str) -> np.ndarray:
+        """BM25 score of every document for the query text."""
+        spans = [
+            (self.indptr[t], self.indptr[t + 1])
+            for t in (self.terms.get(token) for token in tokenize(text)) if t is not None
+        ]
+        if not spans:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        postings = np.concatenate([np.arange(start, end) for start, end in spans])
+        return np.bincount(self.doc_ids[postings], weights=self.weights[postings], minlength=self.n_docs)
+
+    def search(self, text: str, k: int, mask: np.ndarray = None):
+        """Top-k (row, score) for the query, restricted to `mask` rows; rows without any matching term are left out."""
+        scores = self.scores(text)
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(row), float(scores[row])) for row in candidates]
+
+
+def load_or_build_lexical_index(texts) -> LexicalIndex:
+    """Reuse the persisted BM25 index for this exact catalog, or build and persist one."""
+    key = catalog_fingerprint("bm25", texts)[:16]
+    path = os.path.join(CACHE_DIR, f"bm25-{key}.npz")
+    if os.path.exists(path):
+        try:
+            return LexicalIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"BM25 index unreadable, rebuilding: {e}")
+    index = LexicalIndex.build(texts)
+    index.save(path)
+    print(f"Built BM25 index: {len(index.terms)} terms, {len(index.doc_ids)} postings")
+    _remove_stale(path)
+    return index
+
+
+def _remove_stale(current: str):
+    """
+    Delete BM25 indexes of earlier catalogs, keeping the newest one besides
+    `current` for workers that haven't reloaded yet (other processes' .tmp files are left alone).
+    """
+    previous = []
+    for name in os.listdir(CACHE_DIR):
+        if _INDEX_FILE_RE.fullmatch(name) and name != os.path.basename(current):
+            try:
+                previous.append((os.path.getmtime(os.path.join(CACHE_DIR, name)), name))
+            except OSError:
+                pass  # removed by another worker meanwhile
+    for _, name in sorted(previous)[:-1]:
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except OSError:
+            pass
@@ -1,38 +1,60 @@
-import os
-import json
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
+import argparse
 from dotenv import load_dotenv
+from app.database import DATA_PATH, init_courses_db, ingest_courses, delete_courses, bump_catalog_version
+from app.embedding_store import EMBED_BATCH_SIZE, EMBED_WORKERS, encode_with_cache
+from app.catalog import load_catalog
+from app.course_index import EMBEDDING_KEY, get_model, index_keys
+from app.ann_index import load_or_build_index
+from app.lexical_index import load_or_build_lexical_index
 load_dotenv()
 
-DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'courses.json')
 
-with open(DATA_PATH, 'r', encoding='utf-8') as f:
-    courses = json.load(f)
+def refresh_course_index(batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, rebuild=False):
+    """
+    Bring the on-disk embedding store, ANN index and BM25 index up to date
+    with the courses table, so servers reloading after a catalog change only
+    read them back. Only new or edited courses are embedded and added to the
+    ANN index; `rebuild` retrains it from scratch instead.
+    """
+    courses = load_catalog()
+    texts = [courses.text(row) for row in range(len(courses))]
+    embeddings = encode_with_cache(get_model(), EMBEDDING_KEY, texts, batch_size, workers)
+    ann = load_or_build_index(embeddings, index_keys(courses, texts), EMBEDDING_KEY, rebuild=rebuild)
+    if ann.directory:
+        ann.save()
+    load_or_build_lexical_index(texts)
+    print(f"Course index ready: {len(courses)} courses")
+    return ann
 
-# Create documents for FAISS
-documents = [
-    Document(
-        page_content=f"{course['description']} Tags: {', '.join(course['tags'])}",
-        metadata={
-            'id': course['id'],
-            'title': course['title'],
-            'provider': course['provider'],
-            'skill_level': course['skill_level'],
-            'duration': course['duration'],
-            'url': course['url']
-        }
-    )
-    for course in courses
-]
 
-# Initialize Sentence Transformers embeddings (downloads model on first run)
-embeddings = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2"  # or "all-mpnet-base-v2"
-)
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the course catalog and its shared FAISS index")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync_cmd = sub.add_parser("sync", help="make the catalog match a file (embeds new and changed courses only)")
+    sync_cmd.add_argument("--catalog", default=DATA_PATH)
+    upsert_cmd = sub.add_parser("upsert", help="add or update the courses in a JSON/NDJSON file")
+    upsert_cmd.add_argument("file")
+    delete_cmd = sub.add_parser("delete", help="remove courses by id")
+    delete_cmd.add_argument("course_ids", nargs="+")
+    sub.add_parser("rebuild", help="retrain the ANN index from scratch (after heavy churn or growth)")
+    args = parser.parse_args()
 
-# Create FAISS index
-vectorstore = FAISS.from_documents(documents, embeddings)
-# Save to disk for reuse (optional)
-vectorstore.save_local("faiss_index")
\ No newline at end of file
+    init_courses_db()
+    if args.command == "sync":
+        changed = ingest_courses(args.catalog)
+        print(f"{len(changed)} courses added or updated")
+    elif args.command == "upsert":
+        changed = ingest_courses(args.file, full=False)
+        print(f"{len(changed)} courses added or updated")
+    elif args.command == "delete":
+        print(f"Deleted {delete_courses(args.course_ids)} courses")
+    refresh_course_index(args.batch_size, args.workers, rebuild=args.command == "rebuild")
+    if args.command == "rebuild":
+        # The catalog itself is unchanged, so servers need a nudge to load the retrained index
+        bump_catalog_version()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,27 @@
+import os
+import json
 import uuid
-from typing import Union
+from typing import Union, List
 from fastapi import FastAPI, HTTPException
-from app.recommender import recommend_courses, get_recommender_resources
-from app.database import save_feedback
+from fastapi.responses import Response, StreamingResponse
+from app.recommender import recommend_courses, recommend_courses_batch, get_recommender_resources, cache_stats
+from app.database import get_query_stats
+from app.preferences import record_feedback
 
 from app.models import StudentProfile, RecommendationResponse, ParagraphProfile, Feedback, QueryRequest
-from app.qa_bot import app as qa_bot_app
+from app.qa_bot import run_query, stream_query
+from app.concurrency import query_slots, shutdown as shutdown_sync_pool
+from app.embedding_service import get_embedding_service
+from app.metrics import TraceMiddleware, render as render_metrics
+from app.conversation_store import cache_stats as conversation_cache_stats
 from fastapi.middleware.cors import CORSMiddleware
 
 
 app = FastAPI()
 
+# Profiles per encode/search pass in /recommend/batch; bounds memory and lets results stream early
+RECOMMEND_BATCH_CHUNK = int(os.getenv("RECOMMEND_BATCH_CHUNK", "1024"))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -18,17 +29,32 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so the trace id and request latency cover CORS handling too
+app.add_middleware(TraceMiddleware)
 
 
 @app.post("/recommend", response_model=RecommendationResponse)
 def recommend(student: Union[StudentProfile, ParagraphProfile]):
     """Recommend courses for a student profile."""
-    return recommend_courses(student)
+    # Serialized directly: FastAPI would otherwise re-validate the trusted response against response_model
+    return Response(recommend_courses(student).model_dump_json(), media_type="application/json")
+
+
+@app.post("/recommend/batch")
+def recommend_batch(students: List[Union[StudentProfile, ParagraphProfile]]):
+    """Recommend courses for many profiles, streamed back as NDJSON in request order."""
+    def generate():
+        for start in range(0, len(students), RECOMMEND_BATCH_CHUNK):
+            for response in recommend_courses_batch(students[start:start + RECOMMEND_BATCH_CHUNK]):
+                yield response.model_dump_json() + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 
 @app.post("/feedback")
 def submit_feedback(feedback: Feedback):
-    save_feedback(feedback.user_id, feedback.course_id, feedback.feedback)
+    # Bumps the user's feedback version, which is part of their recommendation cache keys
+    record_feedback(feedback.user_id, feedback.course_id, feedback.feedback)
     return {"status": "success", "message": f"Feedback saved for {feedback.course_id}"}
 
 
@@ -39,25 +65,81 @@ def startup_event():
     get_recommender_resources()
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_sync_pool()
+
+
+def initial_query_state(request: QueryRequest, thread_id: str) -> dict:
+    return {
+        "query": request.query,
+        "web_results": [],
+        "db_results": [],
+        "tools_to_call": [],
+        "user_id": request.user_id,
+        "thread_id": thread_id,
+        "conversation_history": []
+    }
+
+
 @app.post("/query")
 async def process_query(request: QueryRequest):
     try:
         thread_id = request.thread_id or str(uuid.uuid4())
         # print("the user requested query is ", request.query)
-        result = qa_bot_app.invoke({
-            "query": request.query,
-            "web_results": [],
-            "db_results": [],
-            "tools_to_call": [],
-            "user_id": request.user_id,
-            "thread_id": thread_id,
-            "conversation_history": []
-        })
+        async with query_slots:
+            result = await run_query(initial_query_state(request, thread_id))
         return {"response": result["final_answer"], "thread_id": thread_id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
 
+@app.post("/query/stream")
+async def process_query_stream(request: QueryRequest):
+    """
+    Server-sent events version of /query: graph progress events, then synthesizer
+    tokens as they arrive, then a final 'done' event carrying the full answer.
+    """
+    thread_id = request.thread_id or str(uuid.uuid4())
+
+    async def events():
+        try:
+            async with query_slots:
+                async for name, payload in stream_query(initial_query_state(request, thread_id)):
+                    if name == 'done':
+                        payload = {**payload, "thread_id": thread_id}
+                    yield f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': f'Error processing query: {e}'})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
+
+
+@app.get("/stats/db")
+def db_stats():
+    """p50/p99 SQLite latency per query type over recent calls."""
+    return get_query_stats()
+
+
+@app.get("/stats/cache")
+def recommendation_cache_stats():
+    """Size and hit rate of the recommendation, query-embedding and conversation-history caches."""
+    return {**cache_stats(), "conversations": conversation_cache_stats()}
+
+
+@app.get("/stats/embeddings")
+def embedding_stats():
+    """Micro-batching of query encodes: batches run, texts encoded, mean batch size."""
+    return get_embedding_service().stats()
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text format: per-stage, per-node, SQLite and LLM latency histograms and token counters."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,192 @@
+import os
+import time
+import uuid
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Histograms/counters are always cheap (a perf_counter pair and a locked bucket increment), but can be turned off
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Prefix log lines with the request's trace id
+LOG_TRACE_IDS = os.getenv("LOG_TRACE_IDS", "false").lower() == "true"
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Request-ID")
+
+# Seconds; spans sub-millisecond index work up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+trace_id = contextvars.ContextVar("trace_id", default=None)
+
+_registry = []
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, *labelvalues):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in sorted(values.items()))
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram with optional labels. observe() is one
+    bisect and a few increments under a lock, so it is cheap enough for
+    every request; buckets are made cumulative only when rendered.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        if not METRICS_ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def timed(self, *labelvalues):
+        """Decorator timing each call of a sync or async function."""
+        def decorator(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await fn(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - start, *labelvalues)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labelvalues)
+            return wrapper
+        return decorator
+
+    def render(self):
+        with self._lock:
+            series = {key: (list(counts), total, n) for key, (counts, total, n) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared across modules
+http_request_seconds = Histogram("http_request_seconds", "HTTP request latency until the last body byte is sent",
+                                 ("method", "route", "status"))
+qa_node_seconds = Histogram("qa_node_seconds", "Latency of each /query LangGraph node", ("node",))
+recommend_stage_seconds = Histogram("recommend_stage_seconds", "Latency of each recommend_courses stage", ("stage",))
+retrieval_stage_seconds = Histogram("retrieval_stage_seconds", "Latency of each CourseIndex search stage", ("stage",))
+sqlite_query_seconds = Histogram("sqlite_query_seconds", "SQLite work per query type, including pool wait", ("query_type",))
+llm_call_seconds = Histogram("llm_call_seconds", "Latency of outbound LLM and web search calls", ("target",))
+llm_errors_total = Counter("llm_errors_total", "Outbound LLM and web search calls that raised", ("target",))
+llm_tokens_total = Counter("llm_tokens_total", "LLM tokens reported by the provider", ("target", "direction"))
+
+
+def log(message: str):
+    """print(), prefixed with the current trace id when LOG_TRACE_IDS is on."""
+    current = trace_id.get() if LOG_TRACE_IDS else None
+    print(f"[{current}] {message}" if current else message)
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware: gives each HTTP request a trace id (the incoming
+    TRACE_HEADER, or a new one), echoes it on the response, and records
+    http_request_seconds by route template once the response has finished.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = TRACE_HEADER.lower().encode('latin-1')
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        incoming = next((value for name, value in scope.get("headers", ()) if name == self.header), None)
+        current = incoming.decode('latin-1')[:64] if incoming else uuid.uuid4().hex[:16]
+        token = trace_id.set(current)
+        status = [500]
+        start = time.perf_counter()
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message = {**message, "headers": list(message.get("headers", ())) + [(self.header, current.encode('latin-1'))]}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                route = scope.get("route")
+                http_request_seconds.observe(time.perf_counter() - start, scope["method"],
+                                             getattr(route, "path", "unmatched"), str(status[0]))
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            trace_id.reset(token)
@@ -6,6 +6,12 @@ class ParagraphProfile(BaseModel):
     name: str
     profile_paragraph: str
 
+class CourseFilters(BaseModel):
+    skill_levels: Optional[List[str]] = None
+    providers: Optional[List[str]] = None
+    tags: Optional[List[str]] = None  # match courses having any of these tags
+    max_duration_hours: Optional[float] = None
+
 class StudentProfile(BaseModel):
     name: str
     background: Optional[str] = None
@@ -13,6 +19,7 @@ class StudentProfile(BaseModel):
     previous_courses: Optional[List[str]] = None
     goals: Optional[str] = None
     skill_levels: Optional[dict] = None
+    filters: Optional[CourseFilters] = None
 
 class Course(BaseModel):
     id: str
@@ -22,7 +29,7 @@ class Course(BaseModel):
     tags: List[str]
     duration: str
     url: str
-    provider: Optional[str]
+    provider: Optional[str] = None
 
 class RecommendationResponse(BaseModel):
     user_id: str
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from app.embedding_store import MODEL_NAME, CACHE_DIR
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(CACHE_DIR, 'onnx', MODEL_NAME))
+# Serve the int8 dynamically quantized graph (model_int8.onnx) rather than fp32 (model.onnx)
+ONNX_QUANTIZED = os.getenv("ONNX_QUANTIZED", "true").lower() == "true"
+# onnxruntime intra-op threads per session (0 lets onnxruntime decide)
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+# Lowest per-course cosine similarity to the PyTorch embeddings that `verify` accepts
+ONNX_MIN_COSINE = float(os.getenv("ONNX_MIN_COSINE", "0.97"))
+
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+def _model_file(quantized: bool) -> str:
+    return "model_int8.onnx" if quantized else "model.onnx"
+
+
+class OnnxEncoder:
+    """
+    Drop-in for the SentenceTransformer calls this app makes (encode,
+    get_sentence_embedding_dimension), running an exported MiniLM graph on
+    onnxruntime with mean pooling. Needs only onnxruntime and tokenizers,
+    so torch is never imported.
+    """
+
+    def __init__(self, model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, "export.json"), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, _model_file(quantized)), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+        # Fast tokenizers are not safe to call from several threads at once
+        self._tokenizer_lock = threading.Lock()
+
+    def get_sentence_embedding_dimension(self):
+        return self.config["dim"]
+
+    def _encode_batch(self, texts):
+        with self._tokenizer_lock:
+            encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+        mask = feeds["attention_mask"][:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, normalize_embeddings=False, **kwargs):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, self.config["dim"]), dtype=np.float32)
+        # Sort by length so each batch pads to a similar size, then restore the order
+        order = np.argsort([-len(t) for t in texts], kind='stable')
+        vectors = np.zeros((len(texts), self.config["dim"]), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            vectors[rows] = self._encode_batch([texts[i] for i in rows])
+        if normalize_embeddings or self.config["normalize"]:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+
+def export(model_dir=ONNX_MODEL_DIR, opset=14):
+    """Export the SentenceTransformer's transformer to ONNX and write an int8 dynamically quantized copy."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    st = SentenceTransformer(MODEL_NAME, device="cpu")
+    transformer = st[0]
+    pooling = st[1]
+    if not getattr(pooling, "pooling_mode_mean_tokens", False):
+        raise ValueError(f"{MODEL_NAME} does not use mean pooling; OnnxEncoder would not match it")
+    hf_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, _model_file(False))
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            tuple(sample[name] for name in INPUT_NAMES),
+            fp32_path,
+            input_names=INPUT_NAMES,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES + ["last_hidden_state"]},
+            opset_version=opset,
+        )
+    quantize_dynamic(fp32_path, os.path.join(model_dir, _model_file(True)), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, "export.json"), 'w', encoding='utf-8') as f:
+        json.dump({
+            "model_name": MODEL_NAME,
+            "dim": st.get_sentence_embedding_dimension(),
+            "max_seq_length": st.max_seq_length,
+            "normalize": any(type(module).__name__ == "Normalize" for module in st),
+            "pad_token": tokenizer.pad_token,
+            "pad_token_id": tokenizer.pad_token_id,
+        }, f, indent=2)
+    for quantized in (False, True):
+        path = os.path.join(model_dir, _model_file(quantized))
+        print(f"Wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+def verify(model_dir=ONNX_MODEL_DIR, quantized=ONNX_QUANTIZED, min_cosine=ONNX_MIN_COSINE, batch_size=64):
+    """
+    Encode the course catalog with PyTorch and with the ONNX graph and compare
+    them row by row. Returns True when every course's cosine agreement is at
+    least min_cosine.
+    """
+    from sentence_transformers import SentenceTransformer
+    from app.catalog import load_catalog
+
+    catalog = load_catalog()
+    texts = [catalog.text(row) for row in range(len(catalog))]
+    if not texts:
+        print("No courses to verify against")
+        return False
+    reference_model = SentenceTransformer(MODEL_NAME, device="cpu")
+    onnx_model = OnnxEncoder(model_dir, quantized)
+
+    timings = {}
+    for name, model in (("torch", reference_model), ("onnx", onnx_model)):
+        start = time.perf_counter()
+        timings[name] = (model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True),
+                         time.perf_counter() - start)
+    reference, onnx_vectors = timings["torch"][0], timings["onnx"][0]
+    cosine = (reference * onnx_vectors).sum(axis=1)
+    print(f"{_model_file(quantized)} vs PyTorch on {len(texts)} courses: "
+          f"mean cosine {cosine.mean():.5f}, min {cosine.min():.5f}")
+    print(f"Encode time: torch {timings['torch'][1]:.2f}s, onnx {timings['onnx'][1]:.2f}s")
+    ok = bool(cosine.min() >= min_cosine)
+    if not ok:
+        print(f"Cosine agreement below {min_cosine}; keep EMBED_BACKEND=torch")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and verify the ONNX Runtime encoder backend")
+    parser.add_argument("command", choices=["export", "verify"])
+    parser.add_argument("--model-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--fp32", action="store_true", help="verify the unquantized graph")
+    parser.add_argument("--min-cosine", type=float, default=ONNX_MIN_COSINE)
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args.model_dir)
+    if not verify(args.model_dir, not args.fp32, args.min_cosine):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import numpy as np
+from app.database import (
+    connection, init_feedback_db, SQL_SAVE_FEEDBACK, SQL_FEEDBACK_VALUE, SQL_USER_FEEDBACK,
+    SQL_USER_FEEDBACK_COUNT, SQL_FEEDBACK_USERS, SQL_USER_VECTORS, SQL_UPSERT_USER_VECTORS,
+    SQL_BUMP_FEEDBACK_VERSION,
+)
+from app.course_index import get_course_index
+
+# How far the query embedding moves toward liked / away from disliked centroids
+PREFERENCE_WEIGHT = 0.2
+BACKFILL_CHUNK = 500
+
+
+def _unpack(row, dim):
+    return {
+        "like": [np.frombuffer(row['liked_sum'], dtype=np.float32, count=dim).copy(), row['liked_count']],
+        "dislike": [np.frombuffer(row['disliked_sum'], dtype=np.float32, count=dim).copy(), row['disliked_count']],
+    }
+
+
+def _write(conn, user_id, fingerprint, sums):
+    conn.execute(SQL_UPSERT_USER_VECTORS, (
+        user_id, fingerprint,
+        sums["like"][0].astype(np.float32).tobytes(), int(sums["like"][1]),
+        sums["dislike"][0].astype(np.float32).tobytes(), int(sums["dislike"][1]),
+    ))
+
+
+def _rebuild(conn, user_id, course_index):
+    """Recompute a user's sums from their feedback rows (inside the caller's transaction)."""
+    dim = course_index.embeddings.shape[1]
+    sums = {"like": [np.zeros(dim, dtype=np.float64), 0], "dislike": [np.zeros(dim, dtype=np.float64), 0]}
+    for row in conn.execute(SQL_USER_FEEDBACK, (user_id,)).fetchall():
+        course_row = course_index.rows.get(row['course_id'])
+        if course_row is not None and row['feedback'] in sums:
+            sums[row['feedback']][0] += course_index.embeddings[course_row]
+            sums[row['feedback']][1] += 1
+    _write(conn, user_id, course_index.fingerprint, sums)
+    return sums
+
+
+def record_feedback(user_id, course_id, feedback):
+    """
+    Save feedback and update the user's running like/dislike sums in the same
+    transaction. Re-sending the same feedback is a no-op; a like<->dislike flip
+    through INSERT OR REPLACE moves the course vector from one sum to the other.
+    """
+    course_index = get_course_index()
+    course_row = course_index.rows.get(course_id)
+    with connection('save_feedback') as conn:
+        # Take the write lock up front so concurrent writers can't interleave read-modify-write
+        conn.execute('BEGIN IMMEDIATE')
+        previous = conn.execute(SQL_FEEDBACK_VALUE, (user_id, course_id)).fetchone()
+        previous = previous['feedback'] if previous else None
+        conn.execute(SQL_SAVE_FEEDBACK, (user_id, course_id, feedback))
+        if previous == feedback:
+            return
+        conn.execute(SQL_BUMP_FEEDBACK_VERSION, (user_id,))
+        if course_row is None:
+            return
+
+        dim = course_index.embeddings.shape[1]
+        row = conn.execute(SQL_USER_VECTORS, (user_id,)).fetchone()
+        if row is None and conn.execute(SQL_USER_FEEDBACK_COUNT, (user_id,)).fetchone()[0] == 1:
+            # First feedback from this user: start from empty sums
+            sums = {"like": [np.zeros(dim, dtype=np.float32), 0], "dislike": [np.zeros(dim, dtype=np.float32), 0]}
+        elif row is None or row['fingerprint'] != course_index.fingerprint:
+            # Not backfilled yet, or computed against an older catalog: rebuild from all feedback rows
+            _rebuild(conn, user_id, course_index)
+            return
+        else:
+            sums = _unpack(row, dim)
+
+        vector = course_index.embeddings[course_row]
+        if previous in sums:
+            sums[previous][0] -= vector
+            sums[previous][1] -= 1
+        if feedback in sums:
+            sums[feedback][0] += vector
+            sums[feedback][1] += 1
+        _write(conn, user_id, course_index.fingerprint, sums)
+
+
+def preference_offsets(user_ids) -> np.ndarray:
+    """
+    Per-user shift to add to a query embedding: PREFERENCE_WEIGHT times the
+    liked centroid minus the disliked centroid, read from the stored sums.
+    Users whose sums are missing or stale are rebuilt once from their feedback.
+    """
+    course_index = get_course_index()
+    dim = course_index.embeddings.shape[1]
+    sums_by_user, stale = {}, []
+    with connection('get_user_vectors') as conn:
+        for user_id in dict.fromkeys(user_ids):
+            row = conn.execute(SQL_USER_VECTORS, (user_id,)).fetchone()
+            if row is not None and row['fingerprint'] == course_index.fingerprint:
+                sums_by_user[user_id] = _unpack(row, dim)
+            elif conn.execute(SQL_USER_FEEDBACK_COUNT, (user_id,)).fetchone()[0]:
+                stale.append(user_id)
+    if stale:
+        with connection('rebuild_user_vectors') as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for user_id in stale:
+                sums_by_user[user_id] = _rebuild(conn, user_id, course_index)
+
+    offsets = np.zeros((len(user_ids), dim), dtype=np.float32)
+    for q, user_id in enumerate(user_ids):
+        if user_id in sums_by_user:
+            (liked, n_liked), (disliked, n_disliked) = sums_by_user[user_id]["like"], sums_by_user[user_id]["dislike"]
+            if n_liked:
+                offsets[q] += PREFERENCE_WEIGHT * liked / n_liked
+            if n_disliked:
+                offsets[q] -= PREFERENCE_WEIGHT * disliked / n_disliked
+    return offsets
+
+
+def backfill(chunk_size=BACKFILL_CHUNK):
+    """Recompute the stored sums of every user with feedback against the current course index."""
+    course_index = get_course_index()
+    with connection('backfill_user_vectors') as conn:
+        user_ids = [row['user_id'] for row in conn.execute(SQL_FEEDBACK_USERS).fetchall()]
+    for start in range(0, len(user_ids), chunk_size):
+        # One short write transaction per chunk so live feedback writes aren't blocked for long
+        with connection('backfill_user_vectors') as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for user_id in user_ids[start:start + chunk_size]:
+                _rebuild(conn, user_id, course_index)
+    print(f"Backfilled preference vectors for {len(user_ids)} users")
+    return len(user_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain per-user preference vectors")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK)
+    args = parser.parse_args()
+    init_feedback_db()
+    backfill(args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,19 +4,29 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_tavily import TavilySearch  # Updated import
 from langchain_core.tools import tool
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_cohere import ChatCohere
 from dotenv import load_dotenv
+from app.course_index import get_course_index
+from app.concurrency import run_sync, call_llm
+from app.query_classifier import classify_locally
+from app.semantic_cache import semantic_cache, CACHE_ENABLED
+from app.conversation_store import recent_turns, record_turn
+from app.metrics import Counter, qa_node_seconds, log
 import os
+import uuid
+import asyncio
 import operator
 import re
 import json
-import sqlite3
 
 
 load_dotenv()
 
+# Start the course search (and optionally the web search) while the query is still being classified
+SPECULATIVE_RETRIEVAL = os.getenv("QA_SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+# Web searches are billed per call, so speculating on them is opt-in
+SPECULATIVE_WEB_SEARCH = os.getenv("QA_SPECULATIVE_WEB_SEARCH", "false").lower() == "true"
+
 #LLMs
 relevance_checker_llm = ChatCohere(model="command-a-03-2025", cohere_api_key=os.getenv("COHERE_API_KEY"))
 llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", google_api_key=os.getenv("GOOGLE_API_KEY"))
@@ -26,21 +36,24 @@ tavily_tool = TavilySearch(max_results=5, tavily_api_key=os.getenv("TAVILY_API_K
 #Tools
 @tool
 def query_courses_semantic(query: str, k: int = 5) -> List[Dict]:
-    """Perform semantic search on courses using FAISS."""
-    embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    vectorstore = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-    results = vectorstore.similarity_search_with_score(query, k=k)
+    """
+    Search courses with hybrid semantic (FAISS) + keyword (BM25) retrieval.
+    Each course has a relevance_score, the reciprocal rank fusion score: higher is more relevant.
+    """
+    course_index = get_course_index()
+    results = course_index.hybrid_search(query, k=k)[0]
+    catalog = course_index.courses
     return [
         {
-            "id": doc.metadata['id'],
-            "title": doc.metadata['title'],
-            "provider": doc.metadata['provider'],
-            "skill_level": doc.metadata['skill_level'],
-            "duration": doc.metadata['duration'],
-            "url": doc.metadata['url'],
-            "similarity_score": score
+            "id": catalog.ids[row],
+            "title": catalog.titles[row],
+            "provider": catalog.providers[row],
+            "skill_level": catalog.skill_levels[row],
+            "duration": catalog.durations[row],
+            "url": catalog.urls[row],
+            "relevance_score": score
         }
-        for doc, score in results
+        for row, score in results
     ]
 
 tools = [tavily_tool, query_courses_semantic]
@@ -58,18 +71,52 @@ class AgentState(TypedDict):
     user_id: str
     # disliked_courses: List[str]
     conversation_history: List[Dict[str, str]]
+    cached_answer: str
+    speculation_id: str
 
 # Node Functions
-def relevance_checker(state):
+# Nodes are async so the graph runs via ainvoke on the event loop; blocking work
+# (SQLite, FAISS) goes through the bounded pool in app.concurrency.
+IRRELEVANT_ANSWER = "Please ask a question related to courses or learning paths."
+
+def apply_classification(state, relevant: bool, action: str):
+    state['is_relevant'] = relevant
+    if not relevant:
+        state['final_answer'] = IRRELEVANT_ANSWER
+        return state
+    action = (action or 'db').lower()
+    state['direct_answer_possible'] = action == 'direct'
+    state['tools_to_call'] = (
+        [] if action == 'direct' else
+        ['web', 'db'] if action == 'both' else
+        ['web'] if action == 'web' else
+        ['db']
+    )
+    return state
+
+async def classify_query(state):
+    """
+    Decide relevance and route in one step. Obvious queries are settled by the
+    local exemplar classifier; the rest take a single LLM round-trip.
+    """
     # Load conversation history for context
-    conn = sqlite3.connect('conversations.db')
-    c = conn.cursor()
-    c.execute("SELECT query, response FROM conversations WHERE thread_id = ? ORDER BY timestamp DESC LIMIT 3", (state['thread_id'],))
-    history = [{"query": row[0], "response": row[1]} for row in c.fetchall()]
-    conn.close()
-    state['conversation_history'] = history
+    state['conversation_history'] = await run_sync(recent_turns, state['thread_id'])
+    # Follow-ups depend on the thread, so only fresh threads use the semantic cache
+    if CACHE_ENABLED and not state['conversation_history']:
+        cached = await run_sync(semantic_cache.lookup, state['query'])
+        if cached is not None:
+            state['cached_answer'] = cached
+            return apply_classification(state, True, 'direct')
+    local = await run_sync(classify_locally, state['query'], bool(state['conversation_history']))
+    if local is not None:
+        log(f"Local classifier: {local}")
+        return apply_classification(state, local['relevant'], local['action'])
+
+    # Cache and local classifier missed: search speculatively while the LLM decides the route
+    start_speculation(state)
     prompt = ChatPromptTemplate.from_template(
         """Classify if this query is relevant to education, courses, skills, or learning paths (or greetings like hi or hello and acknowledgements like good or excellent), considering the conversation history.
+        If it is relevant, also decide how to answer: 'direct' (no tools), 'web' (external data), 'db' (course database), or 'both' (web+db).
         Query: {query}
         Conversation history (last 3): {history}
 
@@ -77,120 +124,120 @@ def relevance_checker(state):
         Respond with ONLY a valid JSON object. No markdown, no code blocks, no extra text.
         Format: {{
             "relevant": "yes" or "no",
+            "action": "direct" or "web" or "db" or "both",
             "reason": "Brief explanation"
         }}
 
         Examples:
-        - Query: "Courses for machine learning", History: [] -> {{"relevant": "yes", "reason": "Asks about courses"}}
-        - Query: "Are they on your website?", History: [{{"query": "CI/CD learning path", "response": "..."}}] -> {{"relevant": "yes", "reason": "Refers to previous course-related query"}}
-        - Query: "What's the weather?", History: [] -> {{"relevant": "no", "reason": "Unrelated to education"}}
-        - Query: "I want to become an AI engineer", History: [] -> {{"relevant": "yes", "reason": "Career transition question related to learning"}}"""
+        - Query: "Courses for machine learning", History: [] -> {{"relevant": "yes", "action": "db", "reason": "Asks about courses"}}
+        - Query: "What is machine learning?", History: [] -> {{"relevant": "yes", "action": "direct", "reason": "General question"}}
+        - Query: "Are they on your website?", History: [{{"query": "CI/CD learning path", "response": "..."}}] -> {{"relevant": "yes", "action": "db", "reason": "Refers to previous courses"}}
+        - Query: "What's the weather?", History: [] -> {{"relevant": "no", "action": "direct", "reason": "Unrelated to education"}}
+        - Query: "I want to become an AI engineer", History: [] -> {{"relevant": "yes", "action": "both", "reason": "Career guidance needs courses and context"}}"""
     )
     try:
         formatted_prompt = prompt.format(query=state['query'], history=json.dumps(state['conversation_history']))
-        # print(f"Formatted prompt: {formatted_prompt}")
-        response = relevance_checker_llm.invoke(formatted_prompt).content
-        print(f"Relevance checker response: {response}")
+        response = (await call_llm(relevance_checker_llm, formatted_prompt)).content
+        log(f"Classifier response: {response}")
         # Extract JSON from Markdown code block or plain text
         match = re.search(r'\{.*?\}', response, re.DOTALL)
         if match:
             response_dict = json.loads(match.group(0))
         else:
             response_dict = {"relevant": "no", "reason": "Invalid response format"}
-        state['is_relevant'] = response_dict.get('relevant', 'no').lower() == 'yes'
-        if not state['is_relevant']:
-            state['final_answer'] = "Please ask a question related to courses or learning paths."
+        return apply_classification(
+            state,
+            response_dict.get('relevant', 'no').lower() == 'yes',
+            response_dict.get('action', 'db')
+        )
     except Exception as e:
-        print(f"Relevance checker error: {e}")
-        state['is_relevant'] = any(keyword in state['query'].lower() for keyword in ['course', 'skill', 'learn', 'education', 'path', 'website'])
-        if not state['is_relevant']:
-            state['final_answer'] = "Please ask a question related to courses or learning paths."
-        else:
-            print("Fallback: Query deemed relevant due to keywords")
-    return state
+        log(f"Classifier error: {e}")
+        relevant = any(keyword in state['query'].lower() for keyword in ['course', 'skill', 'learn', 'education', 'path', 'website'])
+        if relevant:
+            log("Fallback: Query deemed relevant due to keywords")
+        return apply_classification(state, relevant, 'db')
 
-def router(state):
-    if not state['is_relevant']:
-        return state
-    prompt = ChatPromptTemplate.from_template(
-                    """Based on query: {query}
-                    Conversation history (last 3): {history}
-
-                    Decide how to answer: 'direct' (no tools), 'web' (external data), 'db' (course database), or 'both' (web+db).
-
-                    Respond in JSON format:
-                    Respond with ONLY a valid JSON object. No markdown, no code blocks, no extra text.
-                    Format: {{
-                        "action": "direct" or "web" or "db" or "both",
-                        "reason": "Brief explanation"
-                    }}
-
-                    Examples:
-                    - Query: "What is machine learning?" -> {{"action": "direct", "reason": "General question"}}
-                    - Query: "Courses for Python" -> {{"action": "db", "reason": "Specific course recommendation"}}
-                    - Query: "Are they on your website?", History: [{{"query": "CI/CD learning path", ...}}] -> {{"action": "db", "reason": "Refers to previous courses"}}
-                    - Query: "I want to become an AI engineer" -> {{"action": "both", "reason": "Career guidance needs courses and context"}}"""
-    )
+async def fetch_web(query: str) -> List[dict]:
     try:
-        formatted_prompt = prompt.format(query=state['query'], history=json.dumps(state['conversation_history']))
-        # print(f"Router formatted prompt: {formatted_prompt}")
-        response = llm.invoke(formatted_prompt).content
-        print(f"Router response: {response}")
-        match = re.search(r'\{.*?\}', response, re.DOTALL)
-        if match:
-            response_dict = json.loads(match.group(0))
-        else:
-            response_dict = {"action": "db", "reason": "Default to DB"}
-        # response_dict = json.loads(response.strip()) if response.startswith('{') else {"action": "db", "reason": "Default to DB"}
-        action = response_dict.get('action', 'db').lower()
-        state['direct_answer_possible'] = action == 'direct'
-        state['tools_to_call'] = (
-            [] if action == 'direct' else
-            ['web', 'db'] if action == 'both' else
-            ['web'] if action == 'web' else
-            ['db']
-        )
+        results = await call_llm(tavily_tool, query)
+        results = results if isinstance(results, list) else []
+        log(f"Web search returned {len(results)} results")
+        return results
     except Exception as e:
-        print(f"Router error: {e}")
-        state['direct_answer_possible'] = False
-        state['tools_to_call'] = ['db']
+        log(f"Web search error: {e}")
+        return []
+
+async def fetch_db(query: str) -> List[dict]:
+    try:
+        results = await run_sync(query_courses_semantic.invoke, {"query": query, "k": 5})
+        log(f"DB query returned {len(results)} results")
+        return results
+    except Exception as e:
+        log(f"DB query error: {e}")
+        return []
+
+FETCHERS = {'db': fetch_db, 'web': fetch_web}
+
+# Speculative searches in flight, by speculation id then tool; claimed by the tool nodes, otherwise
+# discarded once the route is known and, at the latest, when the request's run ends (see run_query)
+_speculations: Dict[str, Dict[str, asyncio.Task]] = {}
+speculation_total = Counter("qa_speculation_total", "Speculative searches by tool and outcome", ("tool", "outcome"))
+
+def start_speculation(state):
+    """Start the enabled searches for the query under the run's speculation id (runs without one don't speculate)."""
+    kinds = [kind for kind, enabled in (('db', SPECULATIVE_RETRIEVAL), ('web', SPECULATIVE_WEB_SEARCH)) if enabled]
+    speculation_id = state.get('speculation_id')
+    if not kinds or not speculation_id or speculation_id in _speculations:
+        return
+    _speculations[speculation_id] = {kind: asyncio.create_task(FETCHERS[kind](state['query'])) for kind in kinds}
+
+def discard_speculation(speculation_id, keep=()):
+    """Cancel speculative searches the route doesn't need (a course search already on a thread just finishes unused)."""
+    tasks = _speculations.get(speculation_id, {})
+    for kind in [kind for kind in tasks if kind not in keep]:
+        tasks.pop(kind).cancel()
+        speculation_total.inc(1, kind, "discarded")
+    if not tasks:
+        _speculations.pop(speculation_id, None)
+
+async def fetch(state, kind: str) -> List[dict]:
+    """Result of the speculative search for `kind` ('db' or 'web') if one was started, otherwise search now."""
+    tasks = _speculations.get(state.get('speculation_id'), {})
+    task = tasks.pop(kind, None)
+    if not tasks:
+        _speculations.pop(state.get('speculation_id'), None)
+    if task is None:
+        return await FETCHERS[kind](state['query'])
+    speculation_total.inc(1, kind, "used")
+    return await task
+
+async def classifier(state):
+    """
+    Classify the query. When that takes an LLM round-trip, the course search
+    (and, if enabled, the web search) already runs meanwhile, so retrieval is
+    off the critical path; searches the route turns out not to need are discarded.
+    """
+    state = await classify_query(state)
+    if state.get('speculation_id') in _speculations:
+        discard_speculation(state['speculation_id'], keep=state.get('tools_to_call', []) if state.get('is_relevant') else ())
     return state
 
-def web_search(state):
+async def web_search(state):
     results_to_add = []
     if 'web' in state.get('tools_to_call', []):
-        try:
-            results = tavily_tool.invoke(state['query'])
-            results_to_add = results if isinstance(results, list) else []
-            print(f"Web search returned {len(results_to_add)} results")
-        except Exception as e:
-            print(f"Web search error: {e}")
+        results_to_add = await fetch(state, 'web')
     return {"web_results": results_to_add}
 
-def db_query(state):
+async def db_query(state):
     results_to_add = []
     if 'db' in state.get('tools_to_call', []):
-        try:
-            results = query_courses_semantic.invoke({"query": state['query'], "k": 5})
-            results_to_add = results
-            print(f"DB query returned {len(results_to_add)} results")
-        except Exception as e:
-            print(f"DB query error: {e}")
+        results_to_add = await fetch(state, 'db')
     return {"db_results": results_to_add}
 
 
-def synthesizer(state):
-    # Save query and response to SQLite
-    conn = sqlite3.connect('conversations.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO conversations (thread_id, user_id, query, response) VALUES (?, ?, ?, ?)",
-              (state['thread_id'], state['user_id'], state['query'], state.get('final_answer', '')))
-    conn.commit()
-    conn.close()
-
+async def generate_answer(state) -> str:
     if not state['db_results'] and not state['web_results'] and not state['direct_answer_possible']:
-        state['final_answer'] = "No specific courses or information found. Try a different query."
-        return state
+        return "No specific courses or information found. Try a different query."
     if state['direct_answer_possible']:
         prompt = ChatPromptTemplate.from_template(
             """Answer directly: {query}
@@ -205,34 +252,44 @@ def synthesizer(state):
             DB courses: {db_results}
             Provide a helpful response in Markdown. Recommend courses, explain skills, or suggest learning paths. Be concise."""
         )
-    try:
-        state['final_answer'] = llm.invoke(prompt.format(
-            query=state['query'],
-            history=json.dumps(state['conversation_history']),
-            web_results=state['web_results'],
-            db_results=state['db_results']
-        )).content
-    except Exception as e:
-        state['final_answer'] = f"Error generating response: {e}. Try again."
+    # Tokens from this call are forwarded by stream_query when running under astream_events
+    return (await call_llm(llm, prompt.format(
+        query=state['query'],
+        history=json.dumps(state['conversation_history']),
+        web_results=state['web_results'],
+        db_results=state['db_results']
+    ))).content
+
+async def synthesizer(state):
+    cacheable = (
+        CACHE_ENABLED and not state['conversation_history'] and not state.get('cached_answer')
+        and bool(state['db_results'] or state['web_results'] or state['direct_answer_possible'])
+    )
+    if state.get('cached_answer'):
+        state['final_answer'] = state['cached_answer']
+    else:
+        try:
+            state['final_answer'] = await generate_answer(state)
+        except Exception as e:
+            state['final_answer'] = f"Error generating response: {e}. Try again."
+            cacheable = False
+    # Save query and the completed response to SQLite and the thread's cached history
+    await run_sync(record_turn, state['thread_id'], state['user_id'], state['query'], state['final_answer'])
+    if cacheable:
+        await run_sync(semantic_cache.store, state['query'], state['final_answer'])
     return state
 
 # Build Graph
 workflow = StateGraph(state_schema=AgentState)
-workflow.add_node("relevance_checker", relevance_checker)
-workflow.add_node("router", router)
-workflow.add_node("web_search", web_search)
-workflow.add_node("db_query", db_query)
-workflow.add_node("synthesizer", synthesizer)
+for name, node in (("classifier", classifier), ("web_search", web_search),
+                   ("db_query", db_query), ("synthesizer", synthesizer)):
+    workflow.add_node(name, qa_node_seconds.timed(name)(node))
 
 # Edges
-workflow.set_entry_point("relevance_checker")
-workflow.add_conditional_edges(
-    "relevance_checker",
-    lambda s: END if not s['is_relevant'] else "router"
-)
+workflow.set_entry_point("classifier")
 workflow.add_conditional_edges(
-    "router",
-    lambda s: "synthesizer" if s['direct_answer_possible'] else "web_search" if s['tools_to_call'] == ['web'] else "db_query" if s['tools_to_call'] == ['db'] else ["web_search", "db_query"]
+    "classifier",
+    lambda s: END if not s['is_relevant'] else "synthesizer" if s['direct_answer_possible'] else "web_search" if s['tools_to_call'] == ['web'] else "db_query" if s['tools_to_call'] == ['db'] else ["web_search", "db_query"]
 )
 workflow.add_edge("web_search", "synthesizer")
 workflow.add_edge("db_query", "synthesizer")
@@ -240,12 +297,69 @@ workflow.add_edge("synthesizer", END)
 
 app = workflow.compile()
 
+
+def _with_speculation_id(initial_state):
+    return {**initial_state, 'speculation_id': initial_state.get('speculation_id') or uuid.uuid4().hex}
+
+
+async def run_query(initial_state):
+    """Run the graph to completion; speculative searches it leaves behind (e.g. after a node failed) are cancelled."""
+    initial_state = _with_speculation_id(initial_state)
+    try:
+        return await app.ainvoke(initial_state)
+    finally:
+        discard_speculation(initial_state['speculation_id'])
+
+
+def _chunk_text(chunk) -> str:
+    content = getattr(chunk, 'content', '')
+    if isinstance(content, list):
+        return "".join(part.get('text', '') if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+
+async def stream_query(initial_state):
+    """
+    Run the graph and yield (event, payload) pairs as it progresses:
+    'relevance', 'route', 'db_results' / 'web_results', 'token' for each
+    synthesizer chunk, and finally 'done' with the complete answer.
+    """
+    final_answer = None
+    initial_state = _with_speculation_id(initial_state)
+    try:
+        async for event in app.astream_events(initial_state, version="v2"):
+            kind = event['event']
+            node = event.get('metadata', {}).get('langgraph_node')
+            if kind == 'on_chat_model_stream' and node == 'synthesizer':
+                text = _chunk_text(event['data']['chunk'])
+                if text:
+                    yield 'token', {"text": text}
+            elif kind == 'on_chain_end' and event['name'] == node:
+                output = event['data'].get('output') or {}
+                if node == 'classifier':
+                    yield 'relevance', {"relevant": output.get('is_relevant', False)}
+                    if output.get('cached_answer'):
+                        yield 'cache_hit', {}
+                    if output.get('is_relevant'):
+                        yield 'route', {"direct": output.get('direct_answer_possible', False),
+                                        "tools": output.get('tools_to_call', [])}
+                elif node == 'db_query':
+                    yield 'db_results', {"count": len(output.get('db_results', []))}
+                elif node == 'web_search':
+                    yield 'web_results', {"count": len(output.get('web_results', []))}
+            elif kind == 'on_chain_end' and not event.get('parent_ids'):
+                final_answer = (event['data'].get('output') or {}).get('final_answer')
+    finally:
+        # Also runs when the client disconnects and the generator is closed mid-run
+        discard_speculation(initial_state['speculation_id'])
+    yield 'done', {"response": final_answer}
+
 # Interactive testing
 # while True:
 #     query = input("\nEnter query (or 'quit'): ")
 #     if query.lower() == 'quit':
 #         break
-#     result = app.invoke({
+#     result = asyncio.run(app.ainvoke({
 #         "query": query,
 #         "web_results": [],
 #         "db_results": [],
@@ -256,5 +370,5 @@ app = workflow.compile()
 #         "direct_answer_possible": False,
 #         "final_answer": "",
 #         "conversation_history": []
-#     })
+#     }))
 #     print("\nResponse:", result['final_answer'])
\ No newline at end of file
@@ -0,0 +1,80 @@
+import os
+import re
+import threading
+import numpy as np
+from app.course_index import get_model
+from app.embedding_service import get_embedding_service
+
+# Minimum cosine similarity to the nearest exemplar, and lead over the best other label,
+# before a query is classified locally instead of going to the LLM
+LOCAL_THRESHOLD = float(os.getenv("QA_LOCAL_CLASSIFIER_THRESHOLD", "0.72"))
+LOCAL_MARGIN = float(os.getenv("QA_LOCAL_CLASSIFIER_MARGIN", "0.08"))
+
+# label -> (relevant, action, exemplars)
+EXEMPLARS = {
+    "greeting": (True, "direct", [
+        "hi", "hello", "hey there", "good morning", "thanks", "thank you",
+        "great, thanks", "excellent", "good", "ok cool", "bye",
+    ]),
+    "courses": (True, "db", [
+        "courses for python", "python courses", "machine learning courses",
+        "recommend a course on data science", "best courses to learn react",
+        "show me beginner kubernetes courses", "which course should I take for deep learning",
+        "any courses on cloud computing", "suggest courses for devops",
+        "courses to learn sql", "do you have a course on nlp",
+    ]),
+    "off_topic": (False, None, [
+        "what's the weather today", "tell me a joke", "who won the football match",
+        "what is the stock price of apple", "book a flight to paris",
+        "what's a good pizza recipe", "who is the president", "play some music",
+        "how tall is mount everest", "what time is it",
+    ]),
+}
+
+_GREETING_RE = re.compile(
+    r"^\s*(hi+|hello|hey|hiya|yo|good (morning|afternoon|evening)|thanks?( you)?|thx|ok(ay)?|cool|great|good|excellent|bye)[\s!.,]*$",
+    re.IGNORECASE,
+)
+
+_exemplar_matrix = None
+_exemplar_labels = None
+_lock = threading.Lock()
+
+
+def _exemplars():
+    global _exemplar_matrix, _exemplar_labels
+    if _exemplar_matrix is None:
+        with _lock:
+            if _exemplar_matrix is None:
+                labels, texts = [], []
+                for label, (_, _, examples) in EXEMPLARS.items():
+                    labels.extend([label] * len(examples))
+                    texts.extend(examples)
+                matrix = get_model().encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+                _exemplar_labels = np.array(labels)
+                _exemplar_matrix = matrix
+    return _exemplar_matrix, _exemplar_labels
+
+
+def classify_locally(query: str, has_history: bool = False):
+    """
+    Classify obvious queries without a network call.
+    Returns {"relevant", "action", "reason"} or None when the LLM should decide.
+    Off-topic is never decided locally inside a thread, since follow-ups like
+    "are they on your website?" only make sense with the history.
+    """
+    if _GREETING_RE.match(query):
+        return {"relevant": True, "action": "direct", "reason": "Greeting or acknowledgement (local)"}
+
+    matrix, labels = _exemplars()
+    q = get_embedding_service().encode([query], normalize=True)[0]
+    scores = matrix @ q
+    best = int(np.argmax(scores))
+    label = labels[best]
+    runner_up = scores[labels != label].max()
+    if scores[best] < LOCAL_THRESHOLD or scores[best] - runner_up < LOCAL_MARGIN:
+        return None
+    relevant, action, _ = EXEMPLARS[label]
+    if not relevant and has_history:
+        return None
+    return {"relevant": relevant, "action": action, "reason": f"Similar to '{label}' exemplars (local)"}
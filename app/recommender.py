@@ -1,27 +1,30 @@
-import faiss
-from typing import Union
+from typing import Union, List
 from app.models import StudentProfile, RecommendationResponse, ParagraphProfile, Course
-from app.database import get_all_courses, get_user_feedback, get_all_feedback
-from sentence_transformers import SentenceTransformer
+from app.database import get_user_feedback, get_all_feedback, get_feedback_for_users, get_feedback_versions
+from app.course_index import get_course_index, query_embedding_cache
+from app.preferences import preference_offsets
+from app.collaborative import get_factor_model
+from app.lru_cache import LRUCache
+from app.metrics import recommend_stage_seconds
 import numpy as np
+import hashlib
 import json
+import os
 import re
-# import os
 # from langchain_cohere import ChatCohere
 # from dotenv import load_dotenv
 # load_dotenv()
 
 # input_understanding_llm = ChatCohere(model="command-a-03-2025", cohere_api_key=os.getenv("COHERE_API_KEY"))
 
+# Finished recommendations, reused for identical profiles until the user's feedback,
+# the catalog or the collaborative model changes
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "4096"))
+RECOMMENDATION_CACHE_TTL_SECONDS = float(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", "600"))
+recommendation_cache = LRUCache(RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL_SECONDS)
 
 
 
-# Lazy initialization for model, courses, embeddings, and FAISS index
-_model = None
-_all_courses = None
-_course_texts = None
-_course_embeddings = None
-_faiss_index = None
 
 
 def preprocess_input(student: Union[StudentProfile, ParagraphProfile]) -> tuple[str, str]:
@@ -273,56 +276,57 @@ def preprocess_with_llm(structured_input=None, paragraph_input=None):
         return paragraph_input if paragraph_input else str(structured_input)
 
 def get_recommender_resources():
-    global _model, _all_courses, _course_texts, _course_embeddings, _faiss_index
-    if _model is None:
-        print("Starting embedding the models")
-        _model = SentenceTransformer('all-MiniLM-L6-v2')
-    if _all_courses is None:
-        _all_courses = get_all_courses()
-    if _course_texts is None:
-        _course_texts = [f"{c.title} {c.description} {' '.join(c.tags)}" for c in _all_courses]
-    if _course_embeddings is None:
-        _course_embeddings = _model.encode(_course_texts, convert_to_numpy=True)
-    if _faiss_index is None:
-        dim = _course_embeddings.shape[1]
-        _faiss_index = faiss.IndexFlatL2(dim)
-        _faiss_index.add(_course_embeddings)
-        print("Embedded courses successfully")
-    return _model, _all_courses, _faiss_index
+    """Warm up and return (model, courses, faiss index) from the shared CourseIndex."""
+    course_index = get_course_index()
+    return course_index.model, course_index.courses, course_index.index
 
 def adjust_user_embedding(user_id: str, user_embedding: np.ndarray):
-    model, all_courses, _ = get_recommender_resources()
-    feedback_dict = get_user_feedback(user_id)
-    if not feedback_dict:
-        return user_embedding
-
-    liked = []
-    disliked = []
-
-    for cid, fb in feedback_dict.items():
-        course = next((c for c in all_courses if c.id == cid), None)
-        if not course:
-            continue
-        text = f"{course.title} {course.description} {' '.join(course.tags)}"
-        c_emb = model.encode([text], convert_to_numpy=True)
-        if fb == "like":
-            liked.append(c_emb)
-        elif fb == "dislike":
-            disliked.append(c_emb)
-
-    if liked:
-        user_embedding = user_embedding + 0.2 * np.mean(liked, axis=0)
-    if disliked:
-        user_embedding = user_embedding - 0.2 * np.mean(disliked, axis=0)
-
-    return user_embedding
+    """
+    Shift the query embedding toward the centroid of liked courses and away from
+    disliked ones, using the user's stored running sums (one row read).
+    """
+    return user_embedding + preference_offsets([user_id])[0]
+
+def search_filters(student: Union[StudentProfile, ParagraphProfile], exclude_ids: set) -> dict:
+    """Search filters for a profile: its attribute filters (if any) plus the course ids to exclude."""
+    filters = {"exclude_ids": exclude_ids}
+    if isinstance(student, StudentProfile) and student.filters:
+        filters.update(student.filters.model_dump(exclude_none=True))
+    return filters
+
+def recommendation_key(student: Union[StudentProfile, ParagraphProfile], query: str, feedback_version: int, course_index):
+    """
+    Cache key for a profile: user id, a canonical hash of everything that shapes
+    the search (preprocessed query, exclusions, filters) and the versions of
+    the user's feedback, the catalog and the collaborative model.
+    """
+    previous_courses, filters = [], {}
+    if isinstance(student, StudentProfile):
+        previous_courses = sorted(set(student.previous_courses or []))
+        if student.filters:
+            filters = {
+                name: sorted({v.lower() for v in value}) if isinstance(value, list) else value
+                for name, value in student.filters.model_dump(exclude_none=True).items()
+            }
+    payload = json.dumps({"query": query, "previous": previous_courses, "filters": filters}, sort_keys=True)
+    factor_model = get_factor_model()
+    return (
+        student.name,
+        hashlib.sha256(payload.encode('utf-8')).hexdigest(),
+        feedback_version,
+        course_index.fingerprint,
+        factor_model.version if factor_model is not None else None,
+    )
+
+def cache_stats():
+    return {"recommendations": recommendation_cache.stats(), "query_embeddings": query_embedding_cache.stats()}
 
 def recommend_courses(student: Union[StudentProfile, ParagraphProfile]) -> RecommendationResponse:
     """
     Recommend courses using LLM-preprocessed input, cached sentence embeddings, and FAISS index, excluding disliked courses.
     """
     # print("feedbacks", get_user_feedback(student.name))
-    model, all_courses, faiss_index = get_recommender_resources()
+    course_index = get_course_index()
     if isinstance(student, StudentProfile):
         structured_input = {
             "background": student.background,
@@ -337,24 +341,97 @@ def recommend_courses(student: Union[StudentProfile, ParagraphProfile]) -> Recom
         previous_courses = []
        
 
-    query, explanation = preprocess_input(student)
-    user_embedding = model.encode([query], convert_to_numpy=True)
-    user_embedding = adjust_user_embedding(student.name, user_embedding)
-    # Get top 10 courses to ensure enough results after filtering
-    D, I = faiss_index.search(user_embedding, k=10)
+    with recommend_stage_seconds.time("preprocess"):
+        query, explanation = preprocess_input(student)
+    with recommend_stage_seconds.time("cache_lookup"):
+        key = recommendation_key(student, query, get_feedback_versions([student.name])[student.name], course_index)
+        cached = recommendation_cache.get(key)
+    if cached is not None:
+        return cached
+
+    with recommend_stage_seconds.time("feedback_lookup"):
+        feedback_dict = get_user_feedback(student.name)
+    # None when the embedder is saturated; hybrid_search then ranks with BM25 alone
+    with recommend_stage_seconds.time("encode"):
+        user_embedding = course_index.try_encode(query)
+    if user_embedding is not None:
+        with recommend_stage_seconds.time("feedback_adjust"):
+            user_embedding = adjust_user_embedding(student.name, user_embedding)
 
     # Filter out previous courses and disliked courses
     disliked_courses = {
-        course_id for course_id, feedback in get_user_feedback(student.name).items()
+        course_id for course_id, feedback in feedback_dict.items()
         if feedback == 'dislike'
     }
-    recommended = [
-        all_courses[i] for i in I[0]
-        if all_courses[i].id not in previous_courses and all_courses[i].id not in disliked_courses
-    ]
-
-    # Limit to top 5 recommendations
-    recommended = recommended[:5]
-    return RecommendationResponse(user_id=student.name, 
-                                  recommended_courses=recommended,
-                                  explanation=explanation)
\ No newline at end of file
+    with recommend_stage_seconds.time("search"):
+        hits = course_index.hybrid_search(query, k=5, vectors=user_embedding, user_ids=[student.name],
+                                          filters=search_filters(student, set(previous_courses or []) | disliked_courses))[0]
+    recommended = [course_index.courses[row] for row, _ in hits]
+    # Courses come from the trusted catalog; skip re-validating them
+    response = RecommendationResponse.model_construct(user_id=student.name,
+                                                      recommended_courses=recommended,
+                                                      explanation=explanation)
+    # Lexical-only answers under load are a degraded fallback; don't pin them in the cache
+    if user_embedding is not None:
+        recommendation_cache.put(key, response)
+    return response
+
+
+def adjust_user_embeddings_batch(user_ids: List[str], user_embeddings: np.ndarray) -> np.ndarray:
+    """Batch variant of adjust_user_embedding."""
+    return np.asarray(user_embeddings, dtype=np.float32) + preference_offsets(user_ids)
+
+
+def recommend_courses_batch(students: List[Union[StudentProfile, ParagraphProfile]]) -> List[RecommendationResponse]:
+    """
+    Batch variant of recommend_courses: one feedback query, one encode call and
+    one multi-query hybrid search for the profiles not already cached.
+    """
+    if not students:
+        return []
+    course_index = get_course_index()
+
+    with recommend_stage_seconds.time("batch_preprocess"):
+        all_processed = [preprocess_input(student) for student in students]
+    with recommend_stage_seconds.time("batch_cache_lookup"):
+        versions = get_feedback_versions([student.name for student in students])
+        keys = [
+            recommendation_key(student, query, versions[student.name], course_index)
+            for student, (query, _) in zip(students, all_processed)
+        ]
+        responses = [recommendation_cache.get(key) for key in keys]
+    pending = [i for i, response in enumerate(responses) if response is None]
+    if not pending:
+        return responses
+
+    processed = [all_processed[i] for i in pending]
+    user_ids = [students[i].name for i in pending]
+    with recommend_stage_seconds.time("batch_feedback_lookup"):
+        feedback_by_user = get_feedback_for_users(user_ids)
+
+    with recommend_stage_seconds.time("batch_encode"):
+        user_embeddings = course_index.encode([query for query, _ in processed])
+    with recommend_stage_seconds.time("batch_feedback_adjust"):
+        user_embeddings = adjust_user_embeddings_batch(user_ids, user_embeddings)
+
+    # Per-profile attribute filters and exclusions (previous courses and disliked courses)
+    filters = []
+    for student in (students[i] for i in pending):
+        previous_courses = set(student.previous_courses or []) if isinstance(student, StudentProfile) else set()
+        disliked_courses = {
+            course_id for course_id, feedback in feedback_by_user.get(student.name, {}).items()
+            if feedback == 'dislike'
+        }
+        filters.append(search_filters(student, previous_courses | disliked_courses))
+    with recommend_stage_seconds.time("batch_search"):
+        results = course_index.hybrid_search([query for query, _ in processed], k=5,
+                                             filters=filters, vectors=user_embeddings, user_ids=user_ids)
+
+    for i, (_, explanation), hits in zip(pending, processed, results):
+        responses[i] = RecommendationResponse.model_construct(
+            user_id=students[i].name,
+            recommended_courses=[course_index.courses[row] for row, _ in hits],
+            explanation=explanation,
+        )
+        recommendation_cache.put(keys[i], responses[i])
+    return responses
@@ -0,0 +1,142 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import faiss
+import numpy as np
+from app.course_index import get_model, get_course_index
+from app.embedding_service import get_embedding_service
+from app.database import connection
+
+CACHE_ENABLED = os.getenv("QA_CACHE_ENABLED", "1") == "1"
+CACHE_PATH = os.getenv("QA_CACHE_PATH", os.path.join(os.path.dirname(__file__), 'qa_cache.db'))
+# Cosine similarity a new query needs with a cached one to reuse its answer
+CACHE_THRESHOLD = float(os.getenv("QA_CACHE_THRESHOLD", "0.92"))
+CACHE_TTL_SECONDS = float(os.getenv("QA_CACHE_TTL_SECONDS", str(24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("QA_CACHE_MAX_ENTRIES", "5000"))
+
+
+class SemanticCache:
+    """
+    Answers keyed by normalized MiniLM query embeddings. Lookups are an inner
+    product search over a small in-memory FAISS index; entries expire after a
+    TTL, the least recently used are evicted past max_entries, and everything
+    is written through to SQLite so the cache survives restarts. The whole
+    cache is dropped when the course catalog changes.
+    """
+
+    def __init__(self, path=CACHE_PATH, threshold=CACHE_THRESHOLD,
+                 ttl_seconds=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (answer, created_at), oldest access first
+        self._index = None
+        self._catalog_version = None
+        self._next_id = 1
+
+    def _connect(self, query_type):
+        return connection(query_type, self.path)
+
+    def _create_tables(self, conn):
+        conn.execute('''CREATE TABLE IF NOT EXISTS qa_cache
+                        (id INTEGER PRIMARY KEY, query TEXT, answer TEXT, embedding BLOB,
+                         created_at REAL, last_access REAL)''')
+        conn.execute('CREATE TABLE IF NOT EXISTS qa_cache_meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _embed(self, query: str) -> np.ndarray:
+        return get_embedding_service().encode([query], normalize=True)
+
+    def _load(self):
+        """Build the in-memory index from disk, or reset it if the catalog changed."""
+        dim = get_model().get_sentence_embedding_dimension()
+        self._index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        self._entries.clear()
+        self._catalog_version = get_course_index().fingerprint
+        with self._connect('qa_cache_load') as conn:
+            self._create_tables(conn)
+            row = conn.execute("SELECT value FROM qa_cache_meta WHERE key = 'catalog_version'").fetchone()
+            if row is None or row[0] != self._catalog_version:
+                conn.execute('DELETE FROM qa_cache')
+                conn.execute("INSERT OR REPLACE INTO qa_cache_meta (key, value) VALUES ('catalog_version', ?)",
+                             (self._catalog_version,))
+            conn.execute('DELETE FROM qa_cache WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+            rows = conn.execute(
+                'SELECT id, answer, embedding, created_at FROM qa_cache ORDER BY last_access DESC LIMIT ?',
+                (self.max_entries,)
+            ).fetchall()
+            max_id = conn.execute('SELECT MAX(id) FROM qa_cache').fetchone()[0]
+        self._next_id = (max_id or 0) + 1
+        if rows:
+            rows.reverse()
+            ids = np.array([r[0] for r in rows], dtype=np.int64)
+            vectors = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+            self._index.add_with_ids(vectors, ids)
+            for r in rows:
+                self._entries[r[0]] = (r[1], r[3])
+
+    def _ensure_current(self):
+        if self._index is None or get_course_index().fingerprint != self._catalog_version:
+            self._load()
+
+    def _remove(self, ids, conn):
+        ids = list(ids)
+        if not ids:
+            return
+        self._index.remove_ids(np.array(ids, dtype=np.int64))
+        for entry_id in ids:
+            self._entries.pop(entry_id, None)
+        conn.executemany('DELETE FROM qa_cache WHERE id = ?', [(i,) for i in ids])
+
+    def lookup(self, query: str):
+        """Return the cached answer for a semantically equivalent query, or None."""
+        vector = self._embed(query)
+        with self._lock:
+            self._ensure_current()
+            if self._index.ntotal == 0:
+                return None
+            scores, ids = self._index.search(vector, 1)
+            entry_id, score = int(ids[0][0]), float(scores[0][0])
+            if entry_id < 0 or score < self.threshold:
+                return None
+            answer, created_at = self._entries[entry_id]
+            now = time.time()
+            with self._connect('qa_cache_lookup') as conn:
+                if now - created_at > self.ttl_seconds:
+                    self._remove([entry_id], conn)
+                    return None
+                self._entries.move_to_end(entry_id)
+                conn.execute('UPDATE qa_cache SET last_access = ? WHERE id = ?', (now, entry_id))
+            print(f"Semantic cache hit (similarity {score:.3f})")
+            return answer
+
+    def store(self, query: str, answer: str):
+        vector = self._embed(query)
+        with self._lock:
+            self._ensure_current()
+            now = time.time()
+            entry_id = self._next_id
+            self._next_id += 1
+            with self._connect('qa_cache_store') as conn:
+                conn.execute(
+                    'INSERT INTO qa_cache (id, query, answer, embedding, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)',
+                    (entry_id, query, answer, vector[0].tobytes(), now, now)
+                )
+                self._index.add_with_ids(vector, np.array([entry_id], dtype=np.int64))
+                self._entries[entry_id] = (answer, now)
+                overflow = len(self._entries) - self.max_entries
+                if overflow > 0:
+                    self._remove(list(self._entries)[:overflow], conn)
+
+    def clear(self):
+        with self._lock:
+            with self._connect('qa_cache_clear') as conn:
+                # May run before the first lookup/store has created the schema
+                self._create_tables(conn)
+                conn.execute('DELETE FROM qa_cache')
+            self._index = None
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,22 @@
+"""
+Benchmarks and load tests that run without Cohere, Gemini or Tavily keys.
+
+Modules that import the app call isolate() first so benchmark runs write to
+their own SQLite files and embedding cache instead of the app's.
+"""
+import os
+
+WORK_DIR = os.getenv("BENCH_WORK_DIR", os.path.join(os.path.dirname(__file__), 'work'))
+
+
+def isolate(work_dir=WORK_DIR):
+    """Point the app's databases, answer cache and embedding cache at work_dir; must run before importing app modules."""
+    os.makedirs(work_dir, exist_ok=True)
+    os.environ.setdefault("FEEDBACK_DB_PATH", os.path.join(work_dir, 'feedback.db'))
+    os.environ.setdefault("CONVERSATIONS_DB_PATH", os.path.join(work_dir, 'conversations.db'))
+    os.environ.setdefault("QA_CACHE_PATH", os.path.join(work_dir, 'qa_cache.db'))
+    os.environ.setdefault("EMBEDDING_CACHE_DIR", os.path.join(work_dir, 'embedding_cache'))
+    # The LLM clients are constructed at import time and only need a non-empty key
+    for key in ("COHERE_API_KEY", "GOOGLE_API_KEY", "TAVILY_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+    return work_dir
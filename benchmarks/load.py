@@ -0,0 +1,132 @@
+"""
+Concurrent HTTP load driver. Each of --concurrency threads keeps one
+keep-alive connection and sends requests back to back (closed loop), or at
+a fixed total --rate (open loop, so latency includes queueing) for
+--duration seconds.
+
+    python -m benchmarks.load --endpoint recommend --concurrency 32 --duration 30
+    python -m benchmarks.load --endpoint query --concurrency 64 --rate 100
+"""
+import json
+import time
+import argparse
+import threading
+import http.client
+from itertools import islice
+from urllib.parse import urlsplit
+from benchmarks.synthetic import generate_profiles, generate_queries
+from benchmarks.results import latency_stats, print_table, write_results
+
+ENDPOINTS = ("recommend", "recommend_batch", "query", "query_stream")
+
+
+def request_bodies(endpoint: str, n: int, batch_size: int = 32, seed: int = 0):
+    """Pre-serialized (path, body) pairs for the endpoint, so the driver doesn't spend time in json.dumps."""
+    if endpoint == "recommend":
+        return [("/recommend", json.dumps(p).encode()) for p in generate_profiles(n, seed)]
+    if endpoint == "recommend_batch":
+        profiles = generate_profiles(n * batch_size, seed)
+        return [("/recommend/batch", json.dumps(list(islice(profiles, batch_size))).encode()) for _ in range(n)]
+    path = "/query" if endpoint == "query" else "/query/stream"
+    return [(path, json.dumps(q).encode()) for q in generate_queries(n, seed)]
+
+
+class Worker(threading.Thread):
+    def __init__(self, url, bodies, start_at, stop_at, interval, offset, timeout):
+        super().__init__(daemon=True)
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.bodies = bodies
+        self.start_at, self.stop_at = start_at, stop_at
+        self.interval = interval
+        self.offset = offset
+        self.timeout = timeout
+        self.latencies = []
+        self.errors = {}
+
+    def _connect(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def run(self):
+        conn = self._connect()
+        i = 0
+        while True:
+            # Open loop: each worker owns every n-th slot of the schedule
+            scheduled = self.start_at + (self.offset + i) * self.interval if self.interval else time.monotonic()
+            if scheduled >= self.stop_at:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            path, body = self.bodies[i % len(self.bodies)]
+            i += 1
+            try:
+                conn.request("POST", path, body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()  # streamed endpoints: wait for the last byte
+                if response.status != 200:
+                    self.errors[str(response.status)] = self.errors.get(str(response.status), 0) + 1
+                    continue
+            except (OSError, http.client.HTTPException) as e:
+                self.errors[type(e).__name__] = self.errors.get(type(e).__name__, 0) + 1
+                conn.close()
+                conn = self._connect()
+                continue
+            self.latencies.append(time.monotonic() - scheduled)
+        conn.close()
+
+
+def run_load(url, endpoint, concurrency, duration, rate=0.0, requests=1000, batch_size=32, timeout=60.0):
+    bodies = request_bodies(endpoint, requests, batch_size)
+    start_at = time.monotonic() + 0.1
+    stop_at = start_at + duration
+    # Open loop at `rate` req/s: worker w sends at start + (w + i * concurrency) / rate
+    interval = concurrency / rate if rate else 0.0
+    workers = [
+        Worker(url, bodies[w::concurrency] or bodies, start_at, stop_at, interval, w / concurrency, timeout)
+        for w in range(concurrency)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = max(time.monotonic(), stop_at) - start_at
+    latencies = [latency for worker in workers for latency in worker.latencies]
+    errors = {}
+    for worker in workers:
+        for kind, count in worker.errors.items():
+            errors[kind] = errors.get(kind, 0) + count
+    stats = latency_stats(latencies, elapsed)
+    stats["rps"] = stats.pop("ops_per_s", 0.0)
+    stats["errors"] = sum(errors.values())
+    return stats, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test against a running server (see benchmarks.serve)")
+    parser.add_argument("--url", default="http://127.0.0.1:8001")
+    parser.add_argument("--endpoint", choices=ENDPOINTS, action="append",
+                        help="repeat to load several endpoints one after another (default: recommend)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per endpoint")
+    parser.add_argument("--rate", type=float, default=0.0, help="total requests/s (0 = closed loop, as fast as possible)")
+    parser.add_argument("--requests", type=int, default=1000, help="distinct request bodies to cycle through")
+    parser.add_argument("--batch-size", type=int, default=32, help="profiles per /recommend/batch request")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--name", default="load")
+    args = parser.parse_args()
+
+    metrics = {}
+    for endpoint in args.endpoint or ["recommend"]:
+        print(f"Loading /{endpoint} with {args.concurrency} connections for {args.duration:.0f}s")
+        stats, errors = run_load(args.url, endpoint, args.concurrency, args.duration, args.rate,
+                                 args.requests, args.batch_size, args.timeout)
+        if errors:
+            print(f"  errors: {errors}")
+        metrics[f"{endpoint}/c={args.concurrency}"] = stats
+    print_table(metrics)
+    write_results(args.name, vars(args), metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Micro-benchmarks for the recommendation hot path: preprocess_input, query
+encoding (direct and through the micro-batching service), FAISS search per
+index backend, and adjust_user_embedding.
+
+    python -m benchmarks.micro --courses 100000 --search-vectors 1000000
+"""
+import os
+import time
+import argparse
+import numpy as np
+from benchmarks import isolate
+from benchmarks.synthetic import generate_profiles, write_catalog
+from benchmarks.results import latency_stats, print_table, write_results
+
+
+def timed(fn, inputs, warmup=3):
+    """Call fn on each input in turn; returns latency stats in ms."""
+    for x in inputs[:warmup]:
+        fn(x)
+    samples = []
+    for x in inputs:
+        start = time.perf_counter()
+        fn(x)
+        samples.append(time.perf_counter() - start)
+    return latency_stats(samples)
+
+
+def bench_preprocess(profiles):
+    from app.recommender import preprocess_input
+    return {"preprocess_input": timed(preprocess_input, profiles)}
+
+
+def bench_encode(queries):
+    from app.course_index import get_model
+    from app.embedding_service import get_embedding_service
+    model = get_model()
+    service = get_embedding_service()
+    batch = queries[:64]
+    return {
+        "encode/direct": timed(lambda q: model.encode([q], convert_to_numpy=True), queries),
+        "encode/direct_batch64": timed(lambda _: model.encode(batch, batch_size=64, convert_to_numpy=True),
+                                       queries[:max(5, len(queries) // 64)]),
+        "encode/service": timed(lambda q: service.encode([q]), queries),
+    }
+
+
+def bench_faiss(n_vectors, dim, n_queries, k, index_types, seed=0):
+    """Search latency per backend on random unit vectors; recall@k is measured against exact search."""
+    from app.ann_index import build_index, measure_recall
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n_vectors, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[rng.choice(n_vectors, n_queries)] + 0.05 * rng.standard_normal((n_queries, dim), dtype=np.float32)
+    metrics = {}
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_s = time.perf_counter() - start
+        stats = timed(lambda q: index.search(q[None, :], k), list(queries))
+        stats["build_s"] = round(build_s, 2)
+        if index_type != "flat":
+            stats["recall_at_k"] = round(measure_recall(index, vectors, k=k, n_queries=min(n_queries, 200)), 4)
+        metrics[f"faiss/{index_type}/n={n_vectors}"] = stats
+    return metrics
+
+
+def bench_adjust(n_users, likes_per_user, n_calls, seed=0):
+    from app.course_index import get_course_index
+    from app.preferences import record_feedback
+    from app.recommender import adjust_user_embedding
+    course_index = get_course_index()
+    rng = np.random.default_rng(seed)
+    users = [f"bench_adjust_{u}" for u in range(n_users)]
+    for user in users:
+        for row in rng.choice(len(course_index.courses), min(likes_per_user, len(course_index.courses)), replace=False):
+            record_feedback(user, course_index.courses.ids[row], "like" if rng.random() < 0.7 else "dislike")
+    vector = course_index.embeddings[0].copy()
+    calls = [users[i % n_users] for i in range(n_calls)]
+    return {
+        "adjust_user_embedding": timed(lambda user: adjust_user_embedding(user, vector), calls),
+        "adjust_user_embedding/no_feedback": timed(lambda user: adjust_user_embedding(user + "_new", vector), calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the recommendation hot path")
+    parser.add_argument("--courses", type=int, default=0, help="ingest a synthetic catalog of this size (0 keeps data/courses.json)")
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--search-vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-types", default="flat,ivf_flat,ivf_pq,hnsw")
+    parser.add_argument("--only", default="preprocess,encode,faiss,adjust")
+    parser.add_argument("--name", default="micro")
+    args = parser.parse_args()
+
+    work_dir = isolate()
+    if args.courses:
+        os.environ.setdefault("COURSES_DATA_PATH", write_catalog(os.path.join(work_dir, f"courses-{args.courses}.ndjson"), args.courses))
+    from app.models import StudentProfile
+    from app.database import init_db
+    init_db()
+
+    profiles = [StudentProfile(**p) for p in generate_profiles(args.samples)]
+    only = set(args.only.split(","))
+    metrics = {}
+    if "preprocess" in only:
+        metrics.update(bench_preprocess(profiles))
+    if "encode" in only:
+        from app.recommender import preprocess_input
+        metrics.update(bench_encode([preprocess_input(p)[0] for p in profiles]))
+    if "faiss" in only:
+        metrics.update(bench_faiss(args.search_vectors, args.dim, args.samples, args.k, args.index_types.split(",")))
+    if "adjust" in only:
+        metrics.update(bench_adjust(n_users=50, likes_per_user=20, n_calls=args.samples))
+    print_table(metrics)
+    write_results(args.name, vars(args), metrics)
+
+
+if __name__ == "__main__":
+    main()
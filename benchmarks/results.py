@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+
+RESULTS_DIR = os.getenv("BENCH_RESULTS_DIR", os.path.join(os.path.dirname(__file__), 'results'))
+# A metric is a regression when it is this much worse than the baseline
+REGRESSION_TOLERANCE = float(os.getenv("BENCH_REGRESSION_TOLERANCE", "0.10"))
+
+# Metrics where larger is better; every other numeric metric is a latency
+HIGHER_IS_BETTER = ("ops_per_s", "rps")
+
+
+def latency_stats(samples_s, elapsed_s=None) -> dict:
+    """p50/p95/p99/mean in milliseconds, plus ops_per_s (from elapsed_s when the samples overlapped)."""
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000
+    if not len(ms):
+        return {"count": 0}
+    elapsed_s = elapsed_s if elapsed_s is not None else ms.sum() / 1000
+    return {
+        "count": int(len(ms)),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "ops_per_s": round(len(ms) / elapsed_s, 2) if elapsed_s > 0 else 0.0,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(name: str, config: dict, metrics: dict, results_dir=RESULTS_DIR) -> str:
+    """Write one run as JSON: {name, timestamp, environment, config, metrics: {benchmark: stats}}."""
+    os.makedirs(results_dir, exist_ok=True)
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(results_dir, f"{name}-{timestamp}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"name": name, "timestamp": timestamp, "environment": environment(),
+                   "config": config, "metrics": metrics}, f, indent=2)
+    print(f"Results written to {path}")
+    return path
+
+
+def print_table(metrics: dict):
+    for bench, stats in metrics.items():
+        cells = ", ".join(f"{key}={value}" for key, value in stats.items())
+        print(f"  {bench:<40} {cells}")
+
+
+def compare(baseline_path: str, current_path: str, tolerance: float = REGRESSION_TOLERANCE):
+    """List (benchmark, metric, baseline, current, change) for metrics worse than baseline by more than tolerance."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)["metrics"]
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = json.load(f)["metrics"]
+    regressions = []
+    for bench, stats in current.items():
+        for metric, value in stats.items():
+            old = baseline.get(bench, {}).get(metric)
+            if metric == "count" or not isinstance(value, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            print(f"  {bench:<40} {metric:<10} {old:>12} -> {value:<12} {change:+.1%}")
+            if worse > tolerance:
+                regressions.append((bench, metric, old, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args()
+    regressions = compare(args.baseline, args.current, args.tolerance)
+    for bench, metric, old, value, change in regressions:
+        print(f"REGRESSION {bench} {metric}: {old} -> {value} ({change:+.1%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
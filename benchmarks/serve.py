@@ -0,0 +1,35 @@
+"""
+Run the API with the LLMs and web search replaced by local stubs, for load tests.
+
+    python -m benchmarks.serve --courses 100000 --port 8001
+"""
+import os
+import argparse
+from benchmarks import isolate
+from benchmarks.synthetic import write_catalog
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with stubbed LLM and search backends")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--courses", type=int, default=0, help="serve a synthetic catalog of this size (0 keeps data/courses.json)")
+    args = parser.parse_args()
+
+    work_dir = isolate()
+    if args.courses:
+        path = os.path.join(work_dir, f"courses-{args.courses}.ndjson")
+        if not os.path.exists(path):
+            write_catalog(path, args.courses)
+        os.environ.setdefault("COURSES_DATA_PATH", path)
+
+    import uvicorn
+    from benchmarks.stubs import install_stubs
+    # Stubs are patched into this process, so the app runs in a single uvicorn worker
+    install_stubs()
+    from app.main import app
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
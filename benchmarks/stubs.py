@@ -0,0 +1,144 @@
+import os
+import re
+import json
+import random
+import time
+import asyncio
+import hashlib
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+# Simulated latencies: time to first token, per streamed token, and per web search
+CLASSIFIER_LATENCY_MS = float(os.getenv("BENCH_CLASSIFIER_LATENCY_MS", "150"))
+LLM_LATENCY_MS = float(os.getenv("BENCH_LLM_LATENCY_MS", "300"))
+LLM_TOKEN_MS = float(os.getenv("BENCH_LLM_TOKEN_MS", "5"))
+SEARCH_LATENCY_MS = float(os.getenv("BENCH_SEARCH_LATENCY_MS", "400"))
+
+_QUERY_RE = re.compile(r"Query: (.*)")
+_VOCABULARY = ["learn", "python", "course", "skills", "project", "practice", "data", "build", "path", "cloud"]
+_LEARNING_WORDS = ("course", "learn", "skill", "path", "become", "study", "tutorial", "career")
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def classify(prompt: str) -> str:
+    """Deterministic classifier verdict in the JSON shape the real prompt asks for."""
+    match = _QUERY_RE.search(prompt)
+    query = (match.group(1) if match else prompt).lower()
+    if not any(word in query for word in _LEARNING_WORDS):
+        return json.dumps({"relevant": "no", "action": "direct", "reason": "stub: no learning keywords"})
+    if "become" in query or "path" in query or "career" in query:
+        action = "both"
+    elif "course" in query:
+        action = "db"
+    else:
+        action = ("direct", "web", "db")[_digest(query) % 3]
+    return json.dumps({"relevant": "yes", "action": action, "reason": "stub"})
+
+
+def answer(prompt: str, words: int = 60) -> str:
+    """Deterministic Markdown answer whose content depends only on the prompt."""
+    seed = _digest(prompt)
+    rng = random.Random(seed)
+    body = " ".join(rng.choice(_VOCABULARY) for _ in range(words))
+    return f"**Stub answer** ({seed:08x}): {body}."
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Local stand-in for the Cohere / Gemini chat models: fixed time to first
+    token, optional per-token delay, deterministic content. Supports invoke,
+    ainvoke and streaming, so astream_events sees token chunks as with the
+    real models.
+    """
+
+    mode: str = "answer"  # "classifier" or "answer"
+    latency_ms: float = LLM_LATENCY_MS
+    token_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "benchmark-stub"
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        prompt = messages[-1].content if messages else ""
+        return classify(prompt) if self.mode == "classifier" else answer(prompt)
+
+    def _tokens(self, text: str):
+        return [token + " " for token in text.split(" ")]
+
+    def _message(self, messages, text: str) -> AIMessage:
+        # Whitespace tokens stand in for the provider's usage report
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        output_tokens = len(self._tokens(text))
+        return AIMessage(content=text, usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                                       "total_tokens": input_tokens + output_tokens})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text = self._reply(messages)
+        time.sleep((self.latency_ms + self.token_ms * len(self._tokens(text))) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text = self._reply(messages)
+        await asyncio.sleep((self.latency_ms + self.token_ms * len(self._tokens(text))) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, text))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency_ms / 1000)
+        for token in self._tokens(self._reply(messages)):
+            if self.token_ms:
+                await asyncio.sleep(self.token_ms / 1000)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def _search_results(query: str, max_results: int = 5):
+    seed = _digest(query)
+    return [
+        {
+            "title": f"Result {i + 1} for {query}",
+            "url": f"https://example.com/{seed:08x}/{i}",
+            "content": answer(f"{query}:{i}", words=30),
+            "score": round(1.0 - i * 0.1, 2),
+        }
+        for i in range(max_results)
+    ]
+
+
+def _search(query, latency_ms: float):
+    time.sleep(latency_ms / 1000)
+    return _search_results(str(query))
+
+
+async def _asearch(query, latency_ms: float):
+    await asyncio.sleep(latency_ms / 1000)
+    return _search_results(str(query))
+
+
+def stub_search_tool(latency_ms: float = SEARCH_LATENCY_MS):
+    """Runnable with the tavily_tool call shape (invoke/ainvoke with the query string)."""
+    return RunnableLambda(lambda q: _search(q, latency_ms), afunc=lambda q: _asearch(q, latency_ms), name="stub_search")
+
+
+def install_stubs(classifier_latency_ms: float = CLASSIFIER_LATENCY_MS, llm_latency_ms: float = LLM_LATENCY_MS,
+                  token_ms: float = LLM_TOKEN_MS, search_latency_ms: float = SEARCH_LATENCY_MS,
+                  stubs: Optional[dict] = None):
+    """Swap the QA bot's relevance_checker_llm, llm and tavily_tool for local stubs."""
+    from app import qa_bot
+
+    stubs = stubs or {
+        "relevance_checker_llm": StubChatModel(mode="classifier", latency_ms=classifier_latency_ms),
+        "llm": StubChatModel(mode="answer", latency_ms=llm_latency_ms, token_ms=token_ms),
+        "tavily_tool": stub_search_tool(search_latency_ms),
+    }
+    for name, stub in stubs.items():
+        setattr(qa_bot, name, stub)
+    return stubs
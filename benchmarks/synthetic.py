@@ -0,0 +1,111 @@
+import json
+import random
+import argparse
+
+TOPICS = {
+    "machine-learning": ["python", "statistics", "neural-networks", "scikit-learn"],
+    "data-science": ["python", "pandas", "statistics", "data-analysis"],
+    "deep-learning": ["neural-networks", "tensorflow", "pytorch", "computer-vision"],
+    "web-development": ["javascript", "react", "nodejs", "html-css"],
+    "devops": ["docker", "kubernetes", "ci-cd", "cloud"],
+    "cloud": ["aws", "azure", "gcp", "architecture"],
+    "databases": ["sql", "postgresql", "data-engineering", "database"],
+    "mobile-development": ["android", "ios", "flutter", "kotlin"],
+    "algorithms": ["data-structures", "programming", "computer-science", "python"],
+    "nlp": ["transformers", "python", "deep-learning", "text-mining"],
+    "security": ["networking", "cryptography", "linux", "penetration-testing"],
+    "data-engineering": ["spark", "sql", "airflow", "cloud"],
+}
+ADJECTIVES = ["Practical", "Complete", "Applied", "Modern", "Hands-on", "Advanced", "Essential", "Professional"]
+FORMATS = ["Bootcamp", "Specialization", "Masterclass", "Fundamentals", "Crash Course", "Certificate", "Workshop"]
+VERBS = ["Master", "Learn", "Build", "Explore", "Understand", "Practice", "Design", "Deploy"]
+SKILL_LEVELS = ["beginner", "intermediate", "advanced"]
+PROVIDERS = ["Coursera", "Udemy", "edX", "Udacity", "freeCodeCamp", "Pluralsight", "LinkedIn Learning"]
+DURATIONS = ["4 weeks", "6 weeks", "12 weeks", "3 months", "4 months", "6 months", "25 hours", "40 hours", "54 hours"]
+GOALS = [
+    "become a machine learning engineer", "learn react for frontend work", "move into devops",
+    "get a data analyst job", "build mobile apps", "pass a cloud certification", "learn deep learning",
+    "become a backend developer", "work on nlp projects", "become a data engineer",
+]
+BACKGROUNDS = ["computer science student", "self-taught developer", "data analyst", "high school graduate",
+               "software engineer", "mathematics graduate", "career changer from marketing"]
+
+
+def _course(i: int, seed: int) -> dict:
+    # One RNG per row, so any slice of the catalog can be generated independently
+    rng = random.Random(seed * 1_000_003 + i)
+    topic = rng.choice(list(TOPICS))
+    tags = [topic] + rng.sample(TOPICS[topic], rng.randint(1, 3))
+    name = topic.replace('-', ' ').title()
+    return {
+        "id": f"syn_{i:07d}",
+        "title": f"{rng.choice(ADJECTIVES)} {name} {rng.choice(FORMATS)}",
+        "provider": rng.choice(PROVIDERS),
+        "description": f"{rng.choice(VERBS)} {name.lower()} with {', '.join(t.replace('-', ' ') for t in tags[1:])}. "
+                       f"{rng.choice(VERBS)} real projects and best practices step by step.",
+        "skill_level": rng.choice(SKILL_LEVELS),
+        "tags": tags,
+        "duration": rng.choice(DURATIONS),
+        "url": f"https://example.com/courses/{i}",
+    }
+
+
+def generate_courses(n: int, seed: int = 0):
+    """Yield n deterministic synthetic courses in the data/courses.json schema."""
+    for i in range(n):
+        yield _course(i, seed)
+
+
+def write_catalog(path: str, n: int, seed: int = 0) -> str:
+    """Stream n synthetic courses to an NDJSON file that ingest_courses reads line by line."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for course in generate_courses(n, seed):
+            f.write(json.dumps(course) + "\n")
+    return path
+
+
+def generate_profiles(n: int, seed: int = 0, with_filters: float = 0.2):
+    """Yield n StudentProfile request bodies; a with_filters fraction carries search filters."""
+    rng = random.Random(seed)
+    for i in range(n):
+        topic = rng.choice(list(TOPICS))
+        profile = {
+            "name": f"bench_user_{i}",
+            "background": rng.choice(BACKGROUNDS),
+            "interests": [topic] + rng.sample(TOPICS[topic], 2),
+            "goals": rng.choice(GOALS),
+            "skill_levels": {topic: rng.choice(SKILL_LEVELS)},
+        }
+        if rng.random() < with_filters:
+            profile["filters"] = {"skill_levels": [rng.choice(SKILL_LEVELS)], "max_duration_hours": 200}
+        yield profile
+
+
+def generate_queries(n: int, seed: int = 0):
+    """Yield n /query request bodies mixing off-topic, course-search and learning-path questions."""
+    rng = random.Random(seed)
+    templates = [
+        "What {topic} courses do you recommend?",
+        "How do I {goal}?",
+        "What is the learning path to {goal}?",
+        "Explain the basics of {topic}",
+        "What's the weather like today?",
+    ]
+    for i in range(n):
+        topic = rng.choice(list(TOPICS)).replace('-', ' ')
+        query = rng.choice(templates).format(topic=topic, goal=rng.choice(GOALS))
+        yield {"query": query, "user_id": f"bench_user_{i % 1000}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic course catalog for benchmarks")
+    parser.add_argument("path", help="output .ndjson file (point COURSES_DATA_PATH at it)")
+    parser.add_argument("-n", "--courses", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_catalog(args.path, args.courses, args.seed)
+    print(f"Wrote {args.courses} courses to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
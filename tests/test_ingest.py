@@ -0,0 +1,88 @@
+import os
+import json
+import tempfile
+
+os.environ["FEEDBACK_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "feedback.db")
+
+import pytest
+from app import database
+
+
+def course(course_id, title="Intro"):
+    return {"id": course_id, "title": title, "description": "d", "skill_level": "Beginner",
+            "tags": ["python"], "duration": "4 weeks", "url": f"https://example.com/{course_id}", "provider": "X"}
+
+
+def write_catalog(path, courses):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(courses, f)
+    # ingest skips files whose size and mtime it has already seen
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def catalog_ids():
+    return {row["id"] for row in database.iter_course_rows()}
+
+
+@pytest.fixture(autouse=True)
+def empty_catalog():
+    database.init_courses_db()
+    with database.connection("test") as conn:
+        for table in ("courses", "deleted_courses", "ingest_state"):
+            conn.execute(f"DELETE FROM {table}")
+
+
+def test_full_ingest_removes_courses_missing_from_file(tmp_path):
+    path = str(tmp_path / "courses.json")
+    write_catalog(path, [course("a"), course("b")])
+    database.ingest_courses(path)
+    write_catalog(path, [course("a")])
+    database.ingest_courses(path)
+    assert catalog_ids() == {"a"}
+
+
+def test_deleted_course_stays_gone_after_reingest(tmp_path):
+    path = str(tmp_path / "courses.json")
+    write_catalog(path, [course("a"), course("b")])
+    database.ingest_courses(path)
+    assert database.delete_courses(["b"]) == 1
+
+    database.ingest_courses(path)
+    assert catalog_ids() == {"a"}
+    write_catalog(path, [course("a", "Intro, revised"), course("b")])
+    assert database.ingest_courses(path) == {"a"}
+    assert catalog_ids() == {"a"}
+
+
+def test_upsert_adds_without_removing_and_undeletes(tmp_path):
+    path = str(tmp_path / "courses.json")
+    write_catalog(path, [course("a"), course("b")])
+    database.ingest_courses(path)
+    database.delete_courses(["b"])
+
+    extra = str(tmp_path / "extra.json")
+    write_catalog(extra, [course("b"), course("c")])
+    assert database.ingest_courses(extra, full=False) == {"b", "c"}
+    assert catalog_ids() == {"a", "b", "c"}
+    write_catalog(path, [course("a"), course("b"), course("c")])
+    database.ingest_courses(path)
+    assert catalog_ids() == {"a", "b", "c"}
+
+
+def test_invalid_rows_are_skipped_and_provider_is_optional(tmp_path):
+    path = str(tmp_path / "courses.json")
+    no_provider = course("a")
+    del no_provider["provider"]
+    write_catalog(path, [no_provider, {**course("b"), "title": None}, course("c")])
+    assert database.ingest_courses(path) == {"a", "c"}
+    assert catalog_ids() == {"a", "c"}
+
+
+def test_rows_stored_before_validation_are_validated_once():
+    with database.connection("test") as conn:
+        conn.execute(database.SQL_UPSERT_COURSE, database._course_row(course("a"), "h"))
+        conn.execute(database.SQL_UPSERT_COURSE, database._course_row({**course("b"), "tags": "python"}, "h"))
+        conn.execute("DELETE FROM catalog_meta WHERE key = 'rows_validated'")
+    database.init_courses_db()
+    assert catalog_ids() == {"a"}